@@ -0,0 +1,316 @@
+import timeit
+
+import numpy as np
+
+from game import AppleGame, AppleBoard, CompactAppleBoard, PackedBoard
+from monte_carlo_tree_search import MCTS, ArrayMCTS
+
+
+def get_valid_moves_loop(game: AppleGame, board: np.ndarray):
+    """
+    The original pure-Python prefix-sum scan, kept as a reference for the vectorized version.
+    """
+    ROWS, COLS = game.ROWS, game.COLS
+    valid_moves = np.zeros(game.action_size, dtype=np.uint8)
+
+    prefix_sum = np.zeros((ROWS + 1, COLS + 1), dtype=np.int32)
+    for r in range(ROWS):
+        for c in range(COLS):
+            prefix_sum[r+1][c+1] = (board[r][c] +
+                                    prefix_sum[r][c+1] +
+                                    prefix_sum[r+1][c] -
+                                    prefix_sum[r][c])
+
+    index = 0
+    for start_row in range(ROWS):
+        for start_col in range(COLS):
+            for end_row in range(start_row, ROWS):
+                rect_sum = (prefix_sum[end_row+1][start_col+1]
+                            - prefix_sum[start_row][start_col+1]
+                            - prefix_sum[end_row+1][start_col]
+                            + prefix_sum[start_row][start_col])
+                if rect_sum > 10:
+                    index += (ROWS - end_row) * (COLS - start_col)
+                    break
+                for end_col in range(start_col, COLS):
+                    rect_sum = (prefix_sum[end_row+1][end_col+1]
+                                - prefix_sum[start_row][end_col+1]
+                                - prefix_sum[end_row+1][start_col]
+                                + prefix_sum[start_row][start_col])
+
+                    if rect_sum > 10:
+                        index += COLS - end_col
+                        break
+
+                    valid_moves[index] = (rect_sum == 10)
+                    index += 1
+
+    return valid_moves
+
+
+def report(name, seconds, number):
+    print(f"{name:<40} {seconds / number * 1e6:10.1f} us/call")
+
+
+def bench_valid_moves(number=200):
+    game = AppleGame()
+    board = game.get_init_board()
+    assert np.array_equal(get_valid_moves_loop(game, board), game.get_valid_moves(board))
+
+    loop = timeit.timeit(lambda: get_valid_moves_loop(game, board), number=number)
+    vectorized = timeit.timeit(lambda: game.get_valid_moves(board), number=number)
+    report("get_valid_moves (python loop)", loop, number)
+    report("get_valid_moves (vectorized)", vectorized, number)
+    print(f"speedup: {loop / vectorized:.1f}x")
+
+
+def bench_step_batch(num_boards=64, number=20):
+    game = AppleGame()
+    boards = np.stack([game.get_init_board() for _ in range(num_boards)])
+    actions = np.array([np.flatnonzero(game.get_valid_moves(board))[0] for board in boards])
+
+    def step_loop():
+        for board, action in zip(boards, actions):
+            next_state = game.get_next_state(board, action)
+            game.get_valid_moves(next_state)
+            game.has_legal_moves(next_state)
+            game.get_score(next_state)
+
+    loop = timeit.timeit(step_loop, number=number)
+    batched = timeit.timeit(lambda: game.step_batch(boards, actions), number=number)
+    report(f"step x{num_boards} (per-board loop)", loop, number)
+    report(f"step x{num_boards} (step_batch)", batched, number)
+    print(f"speedup: {loop / batched:.1f}x")
+
+
+def bench_incremental_board(number=20):
+    game = AppleGame()
+    board = game.get_init_board()
+    moves = []
+    state = AppleBoard(game, board)
+    while state.has_legal_moves():
+        action = np.flatnonzero(state.valid_moves)[0]
+        moves.append(action)
+        state = state.apply(action)
+
+    def play_from_scratch():
+        b = board
+        for action in moves:
+            b = game.get_next_state(b, action)
+            game.get_valid_moves(b)
+
+    def play_incremental():
+        s = AppleBoard(game, board)
+        for action in moves:
+            s = s.apply(action)
+
+    scratch = timeit.timeit(play_from_scratch, number=number)
+    incremental = timeit.timeit(play_incremental, number=number)
+    report(f"{len(moves)} moves (from scratch)", scratch, number)
+    report(f"{len(moves)} moves (AppleBoard)", incremental, number)
+    print(f"speedup: {scratch / incremental:.1f}x")
+
+
+class UniformModel:
+    def __init__(self, action_size):
+        self.policy = np.ones(action_size) / action_size
+
+    def predict(self, board, valid_moves):
+        policy = self.policy * valid_moves
+        return policy / policy.sum(), np.array([0.5])
+
+
+def bench_tree_engines(num_simulations=200, number=3):
+    game = AppleGame()
+    board = game.get_init_board()
+    model = UniformModel(game.action_size)
+    args = {'num_simulations': num_simulations, 'reuse_tree': False}
+
+    for name, engine in [('Node tree', MCTS), ('array tree', ArrayMCTS)]:
+        mcts = engine(game, model, args)
+        seconds = timeit.timeit(lambda: mcts.run(model, board), number=number)
+        report(f"MCTS.run {num_simulations} sims ({name})", seconds, number)
+
+
+def state_bytes(state):
+    if isinstance(state, CompactAppleBoard):
+        legal_bytes = state.legal_actions.nbytes if state.legal_actions is not None else 0
+        return state_bytes(state.board) + legal_bytes
+    if isinstance(state, AppleBoard):
+        return state.board.nbytes + state.prefix_sum.nbytes + state.valid_moves.nbytes
+    if isinstance(state, PackedBoard):
+        return len(state.data)
+    return np.asarray(state).nbytes
+
+
+def bench_tree_states(num_simulations=200, number=3):
+    game = AppleGame()
+    board = game.get_init_board()
+    model = UniformModel(game.action_size)
+
+    for name, root_state, pack_states in [
+        ('ndarray', board, False),
+        ('PackedBoard', board, True),
+        ('AppleBoard', AppleBoard(game, board), False),
+        ('AppleBoard, pack_states', AppleBoard(game, board), True),
+    ]:
+        mcts = MCTS(game, model, {'num_simulations': num_simulations, 'pack_states': pack_states})
+        seconds = timeit.timeit(lambda: mcts.run(model, root_state), number=number)
+        root = mcts.run(model, root_state)
+        states = [child.state for child in root.children.values() if child.state is not None] + [root.state]
+        per_node = np.mean([state_bytes(state) for state in states])
+        print(f"{name:<24} {per_node:8.0f} B/node {seconds / number * 1e3:8.1f} ms/run")
+
+
+def bench_leaf_batching(num_simulations=256):
+    import torch
+    from model import AppleGameModel
+
+    game = AppleGame()
+    board = game.get_init_board()
+    model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+
+    for leaf_batch_size in [1, 8, 32]:
+        mcts = MCTS(game, model, {'num_simulations': num_simulations, 'leaf_batch_size': leaf_batch_size})
+        mcts.run(model, board)
+        print(f"leaf_batch_size={leaf_batch_size:<3} {mcts.search_stats['leaves_per_sec']:10.0f} leaves/s")
+
+
+def bench_self_play(num_episodes=8, num_simulations=10):
+    import os
+    import time
+    import torch
+    from model import AppleGameModel
+    from self_play import SelfPlayPool
+    from trainer import Trainer
+
+    game = AppleGame()
+    model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+    trainer = Trainer(game, model, {'num_simulations': num_simulations})
+
+    for num_workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+        pool = SelfPlayPool(trainer, num_workers)
+        list(pool.play(num_workers))  # warm up the workers
+        start_time = time.perf_counter()
+        list(pool.play(num_episodes))
+        elapsed = time.perf_counter() - start_time
+        pool.close()
+        print(f"self-play workers={num_workers:<3} {num_episodes / elapsed:8.2f} episodes/s")
+
+
+def bench_scripted_inference(number=2000):
+    import os
+    import tempfile
+    import time
+    import torch
+    from model import AppleGameModel
+    from export import ScriptedPredictor, load_puzzle_net_class, save, trace_apple_game_model, trace_puzzle_net
+
+    game = AppleGame()
+    board = game.get_init_board()
+    valid_moves = game.get_valid_moves(board)
+    model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+
+    with tempfile.TemporaryDirectory() as folder:
+        checkpoint_path = os.path.join(folder, 'latest.pth')
+        scripted_path = os.path.join(folder, 'latest.pt')
+        torch.save({'state_dict': model.state_dict()}, checkpoint_path)
+        save(*trace_apple_game_model(model), scripted_path)
+
+        start_time = time.perf_counter()
+        eager = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        eager.load_state_dict(torch.load(checkpoint_path)['state_dict'])
+        eager.predict(board, valid_moves)
+        report("cold start + first predict (eager)", time.perf_counter() - start_time, 1)
+
+        start_time = time.perf_counter()
+        scripted = ScriptedPredictor.from_file(scripted_path)
+        scripted.predict(board, valid_moves)
+        report("cold start + first predict (scripted)", time.perf_counter() - start_time, 1)
+
+    eager_seconds = timeit.timeit(lambda: eager.predict(board, valid_moves), number=number)
+    scripted_seconds = timeit.timeit(lambda: scripted.predict(board, valid_moves), number=number)
+    report("AppleGameModel.predict (eager)", eager_seconds, number)
+    report("AppleGameModel.predict (scripted)", scripted_seconds, number)
+    print(f"speedup: {eager_seconds / scripted_seconds:.1f}x")
+
+    puzzle_net = load_puzzle_net_class()().eval()
+    puzzle_scripted = ScriptedPredictor(*trace_puzzle_net(puzzle_net))
+
+    def puzzle_eager():
+        with torch.no_grad():
+            return puzzle_net(torch.FloatTensor(board[None].astype(np.float32)))
+
+    number = max(number // 10, 1)
+    eager_seconds = timeit.timeit(puzzle_eager, number=number)
+    scripted_seconds = timeit.timeit(lambda: puzzle_scripted.predict(board), number=number)
+    report("PuzzleNet forward (eager)", eager_seconds, number)
+    report("PuzzleNet forward (scripted)", scripted_seconds, number)
+    print(f"speedup: {eager_seconds / scripted_seconds:.1f}x")
+
+
+def bench_quantized_inference(batch_size=64, number=200):
+    import time
+    import torch
+    from model import AppleGameModel
+    from export import ScriptedPredictor, load_puzzle_net_class, policy_kl, quantize, trace_puzzle_net
+
+    game = AppleGame()
+    boards = np.stack([game.get_init_board() for _ in range(batch_size)])
+    valid_moves = game.get_valid_moves_batch(boards)
+
+    def evals_per_sec(predictor, count, masks):
+        predictor.predict_batch(boards[:count], masks)
+        start_time = time.perf_counter()
+        for _ in range(number):
+            predictor.predict_batch(boards[:count], masks)
+        return count * number / (time.perf_counter() - start_time)
+
+    model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+    puzzle_net = load_puzzle_net_class()()
+    predictors = [
+        ('AppleGameModel', model, quantize(model), valid_moves),
+        ('PuzzleNet', ScriptedPredictor(*trace_puzzle_net(puzzle_net)),
+         ScriptedPredictor(*trace_puzzle_net(quantize(puzzle_net))), None),
+    ]
+    for name, fp32, int8, masks in predictors:
+        kl = policy_kl(fp32, int8, boards, masks)
+        print(f"{name} int8 policy KL: mean {kl.mean():.2e}, max {kl.max():.2e}")
+        for count in [1, batch_size]:
+            count_masks = None if masks is None else masks[:count]
+            fp32_rate = evals_per_sec(fp32, count, count_masks)
+            int8_rate = evals_per_sec(int8, count, count_masks)
+            print(f"{name} batch={count:<3} fp32 {fp32_rate:9.0f} evals/s, int8 {int8_rate:9.0f} evals/s "
+                  f"({int8_rate / fp32_rate:.2f}x)")
+
+
+def bench_policy_heads(grids=((10, 17), (15, 25), (20, 34)), number=100):
+    import torch
+    from model import AppleGameModel
+
+    for rows, cols in grids:
+        game = AppleGame(rows, cols)
+        boards = np.stack([game.get_init_board() for _ in range(32)])
+        valid_moves = game.get_valid_moves_batch(boards)
+        for policy_head in ['dense', 'corner']:
+            model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'),
+                                   policy_head=policy_head, game=game)
+            num_parameters = sum(p.numel() for p in model.parameters())
+            single = timeit.timeit(lambda: model.predict(boards[0], valid_moves[0]), number=number)
+            batch = timeit.timeit(lambda: model.predict_batch(boards, valid_moves), number=max(number // 10, 1))
+            print(f"{rows}x{cols} {game.action_size:>6} actions {policy_head:<6} {num_parameters:>9} params "
+                  f"{single / number * 1e6:9.1f} us/predict "
+                  f"{batch / max(number // 10, 1) * 1e6:10.1f} us/predict_batch x{len(boards)}")
+
+
+if __name__ == '__main__':
+    bench_valid_moves()
+    bench_step_batch()
+    bench_incremental_board()
+    bench_tree_engines()
+    bench_tree_states()
+    bench_leaf_batching()
+    bench_self_play()
+    bench_scripted_inference()
+    bench_quantized_inference()
+    bench_policy_heads()
@@ -0,0 +1,78 @@
+import queue
+import threading
+
+import numpy as np
+import torch
+
+
+class BatchLoader:
+    """
+    Iterates over num_batches training batches from sample_fn(batch_size), a function returning
+    (boards, pi_indices, pi_probs, rewards) NumPy arrays such as ReplayBuffer.sample.
+    Batches are (boards, valid_moves, pi_indices, pi_probs, rewards) tensors, where valid_moves
+    is valid_moves_fn(boards) or None without one.
+    A background thread samples and converts the next prefetch batches while the current
+    training step runs. On CUDA devices the tensors are pinned and copied without blocking.
+    """
+
+    def __init__(self, sample_fn, batch_size, num_batches, device: torch.device, prefetch=2, valid_moves_fn=None):
+        self.sample_fn = sample_fn
+        self.valid_moves_fn = valid_moves_fn
+        self.batch_size = batch_size
+        self.num_batches = num_batches
+        self.device = torch.device(device)
+        self.prefetch = prefetch
+
+    def __len__(self):
+        return self.num_batches
+
+    def make_batch(self):
+        boards, pi_indices, pi_probs, rewards = self.sample_fn(self.batch_size)
+        valid_moves = None
+        if self.valid_moves_fn is not None:
+            valid_moves = torch.from_numpy(np.asarray(self.valid_moves_fn(boards), dtype=bool))
+        tensors = (
+            torch.from_numpy(np.ascontiguousarray(boards.reshape(len(boards), -1), dtype=np.float32)),
+            valid_moves,
+            torch.from_numpy(np.ascontiguousarray(pi_indices, dtype=np.int64)),
+            torch.from_numpy(np.ascontiguousarray(pi_probs, dtype=np.float32)),
+            torch.from_numpy(np.ascontiguousarray(rewards, dtype=np.float32)),
+        )
+        if self.device.type == 'cuda':
+            return tuple(None if t is None else t.pin_memory().to(self.device, non_blocking=True) for t in tensors)
+        return tuple(None if t is None else t.to(self.device) for t in tensors)
+
+    @staticmethod
+    def put(batches, item, stop):
+        """Put item on the queue unless the consumer stops first. Returns whether it was put."""
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce(self, batches, stop):
+        try:
+            for _ in range(self.num_batches):
+                if not self.put(batches, self.make_batch(), stop):
+                    return
+        except Exception as e:
+            self.put(batches, e, stop)
+
+    def __iter__(self):
+        batches = queue.Queue(maxsize=max(self.prefetch, 1))
+        stop = threading.Event()
+        thread = threading.Thread(target=self.produce, args=(batches, stop), daemon=True)
+        thread.start()
+        try:
+            for _ in range(self.num_batches):
+                batch = batches.get()
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            # Let the producer exit if the consumer stops early
+            stop.set()
+            thread.join()
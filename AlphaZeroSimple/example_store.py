@@ -0,0 +1,163 @@
+import json
+import os
+
+import numpy as np
+
+
+class ExampleStore:
+    """
+    Append-only on-disk store of self-play examples, one flat file per column:
+    boards as uint8, policies as sparse (index, float16 probability) pairs with an
+    int64 end offset per example, and float32 rewards. meta.json is rewritten atomically
+    after every append, so examples that were fully written survive a crash and any
+    partially written tail is discarded when the store is reopened. Readers memory-map
+    the columns and only touch the rows they sample. Policy indices are uint16 when every
+    action fits, as on the 10x17 board, and uint32 for larger boards.
+    """
+
+    COLUMNS = {
+        'boards': np.uint8,
+        'rewards': np.float32,
+        'policy_ends': np.int64,
+        'policy_indices': np.uint16,
+        'policy_probs': np.float16,
+    }
+
+    def __init__(self, path, board_shape=None, action_size=None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+        else:
+            if board_shape is None or action_size is None:
+                raise ValueError(f"{path} holds no examples yet; board_shape and action_size are required")
+            self.meta = {
+                'board_shape': list(board_shape),
+                'action_size': action_size,
+                'num_examples': 0,
+                'num_policy_entries': 0,
+            }
+            self.write_meta()
+
+        self.board_shape = tuple(self.meta['board_shape'])
+        self.action_size = self.meta['action_size']
+        self.columns = dict(self.COLUMNS)
+        if self.action_size > np.iinfo(np.uint16).max + 1:
+            self.columns['policy_indices'] = np.uint32
+        self.truncate()
+        self.arrays = None
+
+    def __len__(self):
+        return self.meta['num_examples']
+
+    def column_path(self, name):
+        return os.path.join(self.path, name + '.bin')
+
+    def column_length(self, name):
+        if name == 'boards':
+            return self.meta['num_examples'] * int(np.prod(self.board_shape))
+        if name in ('policy_indices', 'policy_probs'):
+            return self.meta['num_policy_entries']
+        return self.meta['num_examples']
+
+    def truncate(self):
+        """
+        Cut every column back to the length recorded in meta.json.
+        """
+        for name, dtype in self.columns.items():
+            with open(self.column_path(name), 'ab') as f:
+                f.truncate(self.column_length(name) * np.dtype(dtype).itemsize)
+
+    def write_meta(self):
+        tmp_path = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.path, 'meta.json'))
+
+    def append(self, examples):
+        """
+        Append (board, policy, reward) examples. The policy may be a dense action_size vector
+        or an (indices, probabilities) pair.
+        """
+        if not examples:
+            return
+
+        boards, policies, rewards = zip(*examples)
+        indices = []
+        probs = []
+        for policy in policies:
+            if isinstance(policy, tuple):
+                policy_indices, policy_probs = policy
+            else:
+                policy_indices = np.flatnonzero(policy)
+                policy_probs = np.asarray(policy)[policy_indices]
+            policy_indices = np.asarray(policy_indices)
+            if len(policy_indices) and (policy_indices.min() < 0 or policy_indices.max() >= self.action_size):
+                raise ValueError(f"Policy index out of range for {self.action_size} actions")
+            indices.append(policy_indices.astype(self.columns['policy_indices']))
+            probs.append(np.asarray(policy_probs, dtype=np.float16))
+        policy_ends = self.meta['num_policy_entries'] + np.cumsum([len(i) for i in indices])
+
+        columns = {
+            'boards': np.stack([np.asarray(board) for board in boards]).astype(np.uint8),
+            'rewards': np.asarray(rewards, dtype=np.float32),
+            'policy_ends': policy_ends.astype(np.int64),
+            'policy_indices': np.concatenate(indices),
+            'policy_probs': np.concatenate(probs),
+        }
+        for name, values in columns.items():
+            with open(self.column_path(name), 'ab') as f:
+                f.write(values.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+        self.meta['num_examples'] += len(examples)
+        self.meta['num_policy_entries'] = int(policy_ends[-1])
+        self.write_meta()
+        self.arrays = None
+
+    def map_columns(self):
+        if self.arrays is None:
+            self.arrays = {}
+            for name, dtype in self.columns.items():
+                length = self.column_length(name)
+                if length == 0:
+                    self.arrays[name] = np.zeros(0, dtype=dtype)
+                else:
+                    self.arrays[name] = np.memmap(self.column_path(name), dtype=dtype, mode='r', shape=(length,))
+            self.arrays['boards'] = self.arrays['boards'].reshape((-1,) + self.board_shape)
+        return self.arrays
+
+    def get(self, index):
+        """
+        Gather examples as (boards, pi_indices, pi_probs, rewards) arrays, like ReplayBuffer.sample.
+        Policies are padded with zero probabilities to the widest one in the batch.
+        """
+        arrays = self.map_columns()
+        index = np.asarray(index, dtype=np.int64)
+        ends = arrays['policy_ends'][index]
+        starts = np.where(index > 0, arrays['policy_ends'][np.maximum(index - 1, 0)], 0)
+        width = int((ends - starts).max()) if len(index) else 0
+
+        pi_indices = np.zeros((len(index), width), dtype=np.int32)
+        pi_probs = np.zeros((len(index), width), dtype=np.float32)
+        for row, (start, end) in enumerate(zip(starts, ends)):
+            pi_indices[row, :end - start] = arrays['policy_indices'][start:end]
+            pi_probs[row, :end - start] = arrays['policy_probs'][start:end]
+        return np.array(arrays['boards'][index]), pi_indices, pi_probs, np.array(arrays['rewards'][index])
+
+    def sample(self, batch_size):
+        return self.get(np.random.randint(len(self), size=batch_size))
+
+    def tail(self, count):
+        """
+        The last count examples as a list of (board, (indices, probabilities), reward) tuples.
+        """
+        boards, pi_indices, pi_probs, rewards = self.get(np.arange(max(len(self) - count, 0), len(self)))
+        policies = [(indices[probs > 0], probs[probs > 0]) for indices, probs in zip(pi_indices, pi_probs)]
+        return list(zip(boards, policies, rewards))
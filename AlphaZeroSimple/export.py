@@ -0,0 +1,201 @@
+import functools
+import importlib.util
+import json
+import os
+import warnings
+
+import numpy as np
+import torch
+
+from model import AppleGameModel
+
+
+@functools.lru_cache(maxsize=None)
+def load_puzzle_net_class():
+    """
+    PuzzleNet from the sibling apple_game directory. puzzle_net.py is loaded on its own, without
+    the pygame-based apple_game package __init__ and without putting apple_game on sys.path.
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'apple_game', 'puzzle_net.py')
+    spec = importlib.util.spec_from_file_location('apple_game_puzzle_net', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.PuzzleNet
+
+
+def trace(model: torch.nn.Module, example_inputs):
+    """
+    Trace model in eval mode and freeze its weights into the graph.
+    """
+    model.eval()
+    # TorchScript is deprecated in favour of torch.export, but it is what runs without Python
+    # model code on the torch versions we support
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        traced = torch.jit.trace(model, example_inputs)
+        return torch.jit.freeze(traced)
+
+
+def trace_apple_game_model(model: AppleGameModel):
+    """
+    Frozen TorchScript module for forward(boards, valid_moves), returning policy log-probabilities,
+    and the meta ScriptedPredictor needs to feed it.
+    """
+    boards = torch.zeros(1, model.size, device=model.device)
+    valid_moves = torch.ones(1, model.action_size, dtype=torch.bool, device=model.device)
+    meta = {
+        'input_shape': [model.size],
+        'action_size': model.action_size,
+        'masked': True,
+        'policy': 'log_probs',
+    }
+    return trace(model, (boards, valid_moves)), meta
+
+
+def trace_puzzle_net(model, input_shape=(10, 17)):
+    """
+    Frozen TorchScript module for PuzzleNet.forward(boards), returning policy probabilities,
+    and its meta. input_shape must be the board shape the net was built for.
+    """
+    boards = torch.zeros((1,) + tuple(input_shape))
+    meta = {
+        'input_shape': list(input_shape),
+        'action_size': model.policy_fc.out_features,
+        'masked': False,
+        'policy': 'probs',
+    }
+    return trace(model, (boards,)), meta
+
+
+def save(module, meta, path):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        torch.jit.save(module, path, _extra_files={'meta.json': json.dumps(meta)})
+
+
+def load(path):
+    extra_files = {'meta.json': ''}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        module = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+    return module, json.loads(extra_files['meta.json'])
+
+
+def quantize(model: torch.nn.Module):
+    """
+    A copy of model with dynamic int8 Linear layers: weights stored as int8, activations
+    quantized on the fly. CPU only.
+    """
+    model.eval()
+    with warnings.catch_warnings():
+        # torch.ao.quantization points to torchao, which is not a dependency of ours
+        warnings.simplefilter('ignore')
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def policy_kl(reference, candidate, boards, valid_moves=None):
+    """
+    KL(reference || candidate) of the policies two predictors give for each board.
+    """
+    p, _ = reference.predict_batch(boards, valid_moves)
+    q, _ = candidate.predict_batch(boards, valid_moves)
+    p = p.astype(np.float64)
+    q = np.maximum(q.astype(np.float64), 1e-12)
+    terms = np.where(p > 0, p * (np.log(np.maximum(p, 1e-12)) - np.log(q)), 0)
+    return terms.sum(axis=1)
+
+
+def check_policy_kl(reference, candidate, boards, valid_moves=None, tolerance=1e-3):
+    """
+    Raise ValueError if candidate's policy drifts further than tolerance (in nats) from
+    reference's on any of boards. Returns the per-board divergences.
+    """
+    kl = policy_kl(reference, candidate, boards, valid_moves)
+    if kl.max() > tolerance:
+        raise ValueError(f"Policy KL divergence {kl.max():.2e} exceeds the tolerance of {tolerance:.2e}")
+    return kl
+
+
+class ScriptedPredictor:
+    """
+    Inference-only stand-in for AppleGameModel.predict/predict_batch around a module from
+    trace_apple_game_model or trace_puzzle_net. Boards are copied into a preallocated input buffer (grown on demand) and
+    evaluated under torch.inference_mode, with no eval() switching or per-call tensor allocation.
+    """
+
+    def __init__(self, module, meta, max_batch_size=64, num_threads=None):
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        self.module = module
+        self.input_shape = tuple(meta['input_shape'])
+        self.action_size = meta['action_size']
+        self.masked = meta['masked']
+        self.log_probs = meta['policy'] == 'log_probs'
+        self.allocate(max_batch_size)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        module, meta = load(path)
+        return cls(module, meta, **kwargs)
+
+    @classmethod
+    def from_model(cls, model: AppleGameModel, **kwargs):
+        return cls(*trace_apple_game_model(model), **kwargs)
+
+    def allocate(self, max_batch_size):
+        self.max_batch_size = max_batch_size
+        self.boards = torch.zeros((max_batch_size,) + self.input_shape)
+        self.valid_moves = torch.ones(max_batch_size, self.action_size, dtype=torch.bool)
+
+    def predict(self, board, valid_moves=None):
+        pis, vs = self.predict_batch(np.asarray(board)[None],
+                                     None if valid_moves is None else np.asarray(valid_moves)[None])
+        return pis[0], vs[0]
+
+    def predict_batch(self, boards, valid_moves=None):
+        boards = np.asarray(boards)
+        count = len(boards)
+        if count > self.max_batch_size:
+            self.allocate(max(count, 2 * self.max_batch_size))
+
+        self.boards.numpy()[:count] = boards.reshape((count,) + self.input_shape)
+        inputs = (self.boards[:count],)
+        if self.masked:
+            if valid_moves is None:
+                self.valid_moves[:count] = True
+            else:
+                self.valid_moves.numpy()[:count] = valid_moves
+            inputs += (self.valid_moves[:count],)
+
+        with torch.inference_mode():
+            pi, v = self.module(*inputs)
+            if self.log_probs:
+                pi = pi.exp()
+        return pi.numpy(), v.numpy()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export a checkpoint to a frozen TorchScript file.")
+    parser.add_argument('checkpoint', help="Trainer checkpoint, or 'puzzle_net' for an untrained PuzzleNet")
+    parser.add_argument('output')
+    parser.add_argument('--policy-head', default='dense', choices=['dense', 'corner'])
+    args = parser.parse_args()
+
+    if args.checkpoint == 'puzzle_net':
+        module, meta = trace_puzzle_net(load_puzzle_net_class()())
+    else:
+        from game import AppleGame
+
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.get_action_size(), torch.device('cpu'),
+                               policy_head=args.policy_head, game=game)
+        model.load_state_dict(torch.load(args.checkpoint, map_location='cpu')['state_dict'])
+        module, meta = trace_apple_game_model(model)
+    save(module, meta, args.output)
+    print(f"Saved {args.output} ({os.path.getsize(args.output) / 1e6:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,17 +2,31 @@ import numpy as np
 
 
 class AppleGame:
-    def __init__(self):
-        self.COLS = 17
-        self.ROWS = 10
+    def __init__(self, rows=10, cols=17):
+        self.COLS = cols
+        self.ROWS = rows
         self.action_size = int(self.COLS*(self.COLS+1)/2*self.ROWS*(self.ROWS+1)/2)
 
-        self.action_to_range = []
+        # Corner table of every action: one (start_row, start_col, end_row, end_col) row per action
+        ranges = []
         for start_row in range(self.ROWS):
             for start_col in range(self.COLS): 
                 for end_row in range(start_row, self.ROWS): 
                     for end_col in range(start_col, self.COLS):
-                        self.action_to_range.append([start_row, start_col, end_row, end_col])
+                        ranges.append([start_row, start_col, end_row, end_col])
+        self.action_to_range = np.array(ranges, dtype=np.intp)
+        self.start_rows, self.start_cols, self.end_rows, self.end_cols = self.action_to_range.T
+
+        # Flat indices into a (ROWS+1, COLS+1) prefix sum table for the four corners of each action
+        stride = self.COLS + 1
+        self.prefix_top_left = self.start_rows * stride + self.start_cols
+        self.prefix_top_right = self.start_rows * stride + self.end_cols + 1
+        self.prefix_bottom_left = (self.end_rows + 1) * stride + self.start_cols
+        self.prefix_bottom_right = (self.end_rows + 1) * stride + self.end_cols + 1
+
+        # action_index[start_row, start_col, end_row, end_col] -> action, -1 where end < start
+        self.action_index = np.full((self.ROWS, self.COLS, self.ROWS, self.COLS), -1, dtype=np.intp)
+        self.action_index[self.start_rows, self.start_cols, self.end_rows, self.end_cols] = np.arange(self.action_size)
 
     def get_init_board(self):
         b = np.random.randint(1, 10, size=(self.ROWS, self.COLS))
@@ -24,7 +38,12 @@ class AppleGame:
     def get_action_size(self):
         return self.action_size
 
+    def get_init_state(self):
+        return AppleBoard(self, self.get_init_board())
+
     def get_next_state(self, board: np.ndarray, action: int):
+        if isinstance(board, AppleBoard):
+            return board.apply(action)
         b = np.copy(board)
         start_row, start_col, end_row, end_col = self.action_to_range[action]
         sum = b[start_row:end_row+1, start_col:end_col+1].sum()
@@ -33,67 +52,224 @@ class AppleGame:
         return b
 
     def has_legal_moves(self, board: np.ndarray):
-        for start_row in range(self.ROWS):
-            for start_col in range(self.COLS):
-                for end_row in range(start_row, self.ROWS):
-                    for end_col in range(start_col, self.COLS):
-                        rect_sum = np.sum(board[start_row:end_row+1, start_col:end_col+1])
-                        if rect_sum == 10:
-                            return True
-                        if rect_sum > 10:
-                            break
-        return False
-
-    # def get_valid_moves(self, board: np.ndarray):
-    #     valid_moves = np.zeros(self.action_size)
-    #     index = 0
-    #     for start_row in range(self.ROWS):
-    #         for start_col in range(self.COLS):
-    #             for end_row in range(start_row, self.ROWS):
-    #                 for end_col in range(start_col, self.COLS):
-    #                     rect_sum = np.sum(board[start_row:end_row+1, start_col:end_col+1])
-    #                     valid_moves[index] = rect_sum==10
-    #                     index = index+1
-    #     return valid_moves
+        if isinstance(board, AppleBoard):
+            return board.has_legal_moves()
+        return bool(np.any(self.get_rect_sums(self.get_prefix_sum(board)) == 10))
+
+    def get_prefix_sum(self, board: np.ndarray):
+        """
+        Integral image of the board, padded with a leading row and column of zeros.
+        Leading axes are treated as a batch of boards.
+        """
+        prefix_sum = np.zeros(board.shape[:-2] + (self.ROWS + 1, self.COLS + 1), dtype=np.int32)
+        np.cumsum(np.cumsum(board, axis=-2), axis=-1, out=prefix_sum[..., 1:, 1:])
+        return prefix_sum
+
+    def get_rect_sums(self, prefix_sum: np.ndarray, actions=None):
+        """
+        Sum of every action rectangle, gathered from the prefix sum table in one pass.
+        If actions is given, only the sums of those actions are gathered, one per board.
+        """
+        flat = prefix_sum.reshape(prefix_sum.shape[:-2] + (-1,))
+        if actions is None:
+            return (flat[..., self.prefix_bottom_right]
+                    - flat[..., self.prefix_top_right]
+                    - flat[..., self.prefix_bottom_left]
+                    + flat[..., self.prefix_top_left])
+
+        boards = np.arange(flat.shape[0])
+        return (flat[boards, self.prefix_bottom_right[actions]]
+                - flat[boards, self.prefix_top_right[actions]]
+                - flat[boards, self.prefix_bottom_left[actions]]
+                + flat[boards, self.prefix_top_left[actions]])
+
     def get_valid_moves(self, board: np.ndarray):
-        ROWS, COLS = self.ROWS, self.COLS
-        valid_moves = np.zeros(self.action_size, dtype=np.uint8)
-        
-        # prefix_sum (O(ROWS * COLS))
-        prefix_sum = np.zeros((ROWS + 1, COLS + 1), dtype=np.int32)
-        
-        for r in range(ROWS):
-            for c in range(COLS):
-                prefix_sum[r+1][c+1] = (board[r][c] + 
-                                        prefix_sum[r][c+1] + 
-                                        prefix_sum[r+1][c] - 
-                                        prefix_sum[r][c])
-
-        index = 0
-        for start_row in range(ROWS):
-            for start_col in range(COLS):
-                for end_row in range(start_row, ROWS):
-                    rect_sum = (prefix_sum[end_row+1][start_col+1] 
-                                - prefix_sum[start_row][start_col+1] 
-                                - prefix_sum[end_row+1][start_col] 
-                                + prefix_sum[start_row][start_col])
-                    if rect_sum > 10:
-                        index += (ROWS - end_row) * (COLS - start_col)
-                        break  
-                    for end_col in range(start_col, COLS):
-                        rect_sum = (prefix_sum[end_row+1][end_col+1] 
-                                    - prefix_sum[start_row][end_col+1] 
-                                    - prefix_sum[end_row+1][start_col] 
-                                    + prefix_sum[start_row][start_col])
-                        
-                        if rect_sum > 10:
-                            index += COLS - end_col
-                            break
-
-                        valid_moves[index] = (rect_sum == 10)
-                        index += 1
-
-        return valid_moves
+        if isinstance(board, AppleBoard):
+            return board.valid_moves
+        rect_sums = self.get_rect_sums(self.get_prefix_sum(board))
+        return (rect_sums == 10).astype(np.uint8)
 
     def get_score(self, board: np.ndarray):
-        return np.count_nonzero(board == 0)
\ No newline at end of file
+        if isinstance(board, AppleBoard):
+            return board.score()
+        return np.count_nonzero(board == 0)
+
+    # Batched counterparts: boards is an (N, ROWS, COLS) array and actions an (N,) vector
+
+    def get_action_cells(self, actions: np.ndarray):
+        """
+        Boolean (N, ROWS, COLS) masks of the cells covered by each action.
+        """
+        rows = np.arange(self.ROWS)
+        cols = np.arange(self.COLS)
+        in_rows = (self.start_rows[actions, None] <= rows) & (rows <= self.end_rows[actions, None])
+        in_cols = (self.start_cols[actions, None] <= cols) & (cols <= self.end_cols[actions, None])
+        return in_rows[:, :, None] & in_cols[:, None, :]
+
+    def get_next_state_batch(self, boards: np.ndarray, actions: np.ndarray):
+        actions = np.asarray(actions)
+        legal = self.get_rect_sums(self.get_prefix_sum(boards), actions) == 10
+        cleared = self.get_action_cells(actions) & legal[:, None, None]
+        return np.where(cleared, 0, boards)
+
+    def get_valid_moves_batch(self, boards: np.ndarray):
+        return (self.get_rect_sums(self.get_prefix_sum(boards)) == 10).astype(np.uint8)
+
+    def has_legal_moves_batch(self, boards: np.ndarray):
+        return np.any(self.get_rect_sums(self.get_prefix_sum(boards)) == 10, axis=1)
+
+    def get_score_batch(self, boards: np.ndarray):
+        return np.count_nonzero(boards == 0, axis=(1, 2))
+
+    def step_batch(self, boards: np.ndarray, actions: np.ndarray):
+        """
+        Apply one action per board and return (next_states, valid_moves, terminals, scores)
+        for the resulting boards in a single vectorized pass.
+        """
+        next_states = self.get_next_state_batch(boards, actions)
+        valid_moves = self.get_valid_moves_batch(next_states)
+        terminals = ~valid_moves.any(axis=1)
+        scores = self.get_score_batch(next_states)
+        return next_states, valid_moves, terminals, scores
+
+
+class AppleBoard:
+    """
+    A board that carries its prefix sums and legal-move mask, so that applying an action
+    only updates the region and the rectangles it touches instead of recomputing everything.
+    Instances are treated as immutable: apply returns a new board.
+    """
+
+    def __init__(self, game: AppleGame, board: np.ndarray, prefix_sum=None, valid_moves=None):
+        self.game = game
+        self.board = board
+        self.prefix_sum = game.get_prefix_sum(board) if prefix_sum is None else prefix_sum
+        if valid_moves is None:
+            valid_moves = (game.get_rect_sums(self.prefix_sum) == 10).astype(np.uint8)
+        self.valid_moves = valid_moves
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.board
+        return self.board.astype(dtype)
+
+    def __repr__(self):
+        return self.board.__str__()
+
+    def apply(self, action: int):
+        if not self.valid_moves[action]:
+            return self
+
+        game = self.game
+        start_row, start_col, end_row, end_col = game.action_to_range[action]
+
+        board = np.copy(self.board)
+        board[start_row:end_row+1, start_col:end_col+1] = 0
+
+        # Only prefix sums below and to the right of the cleared rectangle change; rebuild that
+        # quadrant from its own cumulative sums and the untouched row and column bordering it
+        prefix_sum = np.copy(self.prefix_sum)
+        quadrant = np.cumsum(np.cumsum(board[start_row:, start_col:], axis=0), axis=1)
+        prefix_sum[start_row+1:, start_col+1:] = (quadrant
+                                                  + prefix_sum[start_row, start_col+1:]
+                                                  + prefix_sum[start_row+1:, start_col, None]
+                                                  - prefix_sum[start_row, start_col])
+
+        # Only rectangles overlapping the cleared one can change legality
+        affected = game.action_index[:end_row+1, :end_col+1, start_row:, start_col:].reshape(-1)
+        affected = affected[affected >= 0]
+        flat = prefix_sum.reshape(-1)
+        rect_sums = (flat[game.prefix_bottom_right[affected]]
+                     - flat[game.prefix_top_right[affected]]
+                     - flat[game.prefix_bottom_left[affected]]
+                     + flat[game.prefix_top_left[affected]])
+        valid_moves = np.copy(self.valid_moves)
+        valid_moves[affected] = rect_sums == 10
+
+        return AppleBoard(game, board, prefix_sum, valid_moves)
+
+    def has_legal_moves(self):
+        return bool(self.valid_moves.any())
+
+    def score(self):
+        return np.count_nonzero(self.board == 0)
+
+    def compact(self, pack_board=False):
+        if pack_board:
+            return CompactAppleBoard(PackedBoard.from_array(self.board))
+        index_dtype = np.uint16 if self.game.get_action_size() <= np.iinfo(np.uint16).max + 1 else np.uint32
+        return CompactAppleBoard(self.board.astype(np.uint8), np.flatnonzero(self.valid_moves).astype(index_dtype))
+
+
+class CompactAppleBoard:
+    """
+    What an MCTS node keeps of an AppleBoard. By default that is the board as uint8 and the
+    indices of its legal actions, about 300 B on 10x17 (a board has some 50-80 legal moves),
+    from which load rebuilds the prefix sums and the mask. With a PackedBoard alone it is
+    85 B, and load recomputes the legal moves from scratch. A full AppleBoard takes 10.5 KB
+    (1360 B board, 792 B prefix sums, 8415 B mask).
+    """
+    __slots__ = ('board', 'legal_actions')
+
+    def __init__(self, board, legal_actions: np.ndarray = None):
+        self.board = board
+        self.legal_actions = legal_actions
+
+    def load(self, game: AppleGame):
+        board = np.asarray(self)
+        if self.legal_actions is None:
+            return AppleBoard(game, board)
+        valid_moves = np.zeros(game.get_action_size(), dtype=np.uint8)
+        valid_moves[self.legal_actions] = 1
+        return AppleBoard(game, board, valid_moves=valid_moves)
+
+    def __array__(self, dtype=None, copy=None):
+        # Boards everywhere else are int64, whichever form is stored
+        dtype = np.int64 if dtype is None else dtype
+        if isinstance(self.board, PackedBoard):
+            return self.board.to_array(dtype)
+        return self.board.astype(dtype)
+
+    def __repr__(self):
+        return np.asarray(self).__str__()
+
+
+class PackedBoard:
+    """
+    Compact, hashable board: cell values 0-9 stored 4 bits per cell, two cells per byte.
+    A 10x17 board takes 85 bytes instead of the 1360 bytes of an int64 ndarray.
+    """
+    __slots__ = ('data', 'shape', '_hash')
+
+    def __init__(self, data: bytes, shape):
+        self.data = data
+        self.shape = tuple(shape)
+        self._hash = hash(data)
+
+    @classmethod
+    def from_array(cls, board):
+        board = np.asarray(board)
+        cells = board.astype(np.uint8).reshape(-1)
+        if len(cells) % 2:
+            cells = np.append(cells, np.uint8(0))
+        packed = (cells[0::2] << 4) | cells[1::2]
+        return cls(packed.tobytes(), board.shape)
+
+    def to_array(self, dtype=np.int64):
+        packed = np.frombuffer(self.data, dtype=np.uint8)
+        cells = np.empty(2 * len(packed), dtype=dtype)
+        cells[0::2] = packed >> 4
+        cells[1::2] = packed & 0x0F
+        return cells[:int(np.prod(self.shape))].reshape(self.shape)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.to_array(np.int64 if dtype is None else dtype)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        return isinstance(other, PackedBoard) and self.data == other.data and self.shape == other.shape
+
+    def __repr__(self):
+        return self.to_array().__str__()
@@ -0,0 +1,158 @@
+import queue
+import threading
+import time
+import traceback
+from collections import Counter, deque
+
+import numpy as np
+
+from model import AppleGameModel
+
+
+class InferenceClient:
+    """
+    Drop-in replacement for AppleGameModel.predict that forwards boards to an InferenceServer.
+    Picklable, so it can be handed to a self-play worker process. Raises RuntimeError if the
+    server fails to evaluate a request or stops while a request is waiting.
+    """
+
+    def __init__(self, client_id, requests, responses, stopped):
+        self.client_id = client_id
+        self.requests = requests
+        self.responses = responses
+        self.stopped = stopped
+        self.request_id = 0
+
+    def predict(self, board, valid_moves=None):
+        pis, vs = self.predict_batch(np.asarray(board, dtype=np.float32)[None],
+                                     None if valid_moves is None else np.asarray(valid_moves)[None])
+        return pis[0], vs[0]
+
+    def predict_batch(self, boards, valid_moves=None):
+        self.request_id += 1
+        boards = np.asarray(boards, dtype=np.float32)
+        if valid_moves is not None:
+            valid_moves = np.asarray(valid_moves, dtype=bool)
+        self.requests.put((self.client_id, self.request_id, boards, valid_moves, time.monotonic()))
+        while True:
+            try:
+                request_id, result = self.responses.get(timeout=1)
+                break
+            except queue.Empty:
+                # The server may have stopped after the last check; give its reply one more chance
+                if self.stopped.is_set() and self.responses.empty():
+                    raise RuntimeError(f"Inference server stopped before answering client {self.client_id}")
+        if request_id != self.request_id:
+            raise RuntimeError(f"Inference client {self.client_id} got response {request_id}, expected {self.request_id}")
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class InferenceServer:
+    """
+    Collects predict requests from many clients, batches them up to max_batch_size boards or
+    until timeout seconds after the first request, runs one forward pass and scatters the results.
+    Runs on a thread of the process that owns the model.
+    """
+
+    def __init__(self, model: AppleGameModel, num_clients, context, max_batch_size=64, timeout=0.002):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self.requests = context.Queue()
+        self.responses = [context.Queue() for _ in range(num_clients)]
+        # Set once serve returns, however it returns, so waiting clients give up instead of hanging
+        self.stopped = context.Event()
+        self.thread = None
+
+        self.num_requests = 0
+        self.batch_sizes = Counter()
+        self.queue_depths = deque(maxlen=10000)
+        self.latencies = deque(maxlen=10000)
+
+    def client(self, client_id):
+        return InferenceClient(client_id, self.requests, self.responses[client_id], self.stopped)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.requests.put(None)
+        self.thread.join()
+
+    def serve(self):
+        try:
+            self.serve_requests()
+        finally:
+            self.stopped.set()
+
+    def serve_requests(self):
+        running = True
+        while running:
+            request = self.requests.get()
+            if request is None:
+                return
+
+            batch = [request]
+            num_boards = len(request[2])
+            deadline = time.monotonic() + self.timeout
+            while num_boards < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is None:
+                    running = False
+                    break
+                batch.append(request)
+                num_boards += len(request[2])
+
+            self.queue_depths.append(self.requests.qsize())
+            try:
+                self.run_batch(batch)
+            except Exception:
+                # Fail the waiting requests rather than the thread, which every client depends on
+                error = RuntimeError(f"Inference server failed on a batch of {num_boards} boards:\n{traceback.format_exc()}")
+                for client_id, request_id, _, _, _ in batch:
+                    self.responses[client_id].put((request_id, error))
+
+    def run_batch(self, batch):
+        boards = np.concatenate([boards for _, _, boards, _, _ in batch])
+        valid_moves = None
+        if any(masks is not None for _, _, _, masks, _ in batch):
+            # Requests without a mask are evaluated over all actions
+            valid_moves = np.concatenate([
+                masks if masks is not None else np.ones((len(request_boards), self.model.action_size), dtype=bool)
+                for _, _, request_boards, masks, _ in batch
+            ])
+        pis, vs = self.model.predict_batch(boards, valid_moves)
+
+        offset = 0
+        done = time.monotonic()
+        for client_id, request_id, boards, _, sent in batch:
+            self.responses[client_id].put((request_id, (pis[offset:offset + len(boards)], vs[offset:offset + len(boards)])))
+            offset += len(boards)
+            self.latencies.append(done - sent)
+
+        self.num_requests += len(batch)
+        self.batch_sizes[offset] += 1
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000
+        queue_depths = np.array(self.queue_depths)
+        return {
+            'requests': self.num_requests,
+            'batches': sum(self.batch_sizes.values()),
+            'batch_size_histogram': dict(sorted(self.batch_sizes.items())),
+            'queue_depth_mean': float(queue_depths.mean()) if len(queue_depths) else 0.0,
+            'queue_depth_max': int(queue_depths.max()) if len(queue_depths) else 0,
+            'latency_ms': {
+                f'p{p}': float(np.percentile(latencies, p)) if len(latencies) else 0.0
+                for p in [50, 90, 99]
+            },
+        }
@@ -7,20 +7,45 @@ from trainer import Trainer
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 args = {
+    'rows': 10,                                     # Board height
+    'cols': 17,                                     # Board width
+    'policy_head': 'dense',                         # 'dense' (one output per action) or 'corner' (per-cell corner embeddings)
     'batch_size': 64,
     'numIters': 500,                                # Total number of training iterations
     'num_simulations': 50,                         # Total number of MCTS simulations to run when deciding on a move to play
+    'leaf_batch_size': 1,                           # MCTS leaves evaluated per forward pass (virtual loss spreads them)
+    'virtual_loss': 1,                              # Visits temporarily added to pending paths when leaf_batch_size > 1
+    'reuse_tree': True,                             # Keep the chosen child's subtree as the next search root
     'numEps': 100,                                  # Number of full games (episodes) to run during each iteration
-    'numItersForTrainExamplesHistory': 20,
+    'num_workers': 1,                               # Self-play worker processes (1 plays in the trainer process)
+    'inference_server': False,                      # Workers share the trainer's model through a batching inference server
+    'inference_batch_size': 64,                     # Max boards per inference server forward pass
+    'inference_timeout': 0.002,                     # Seconds the server waits to fill a batch
+    'scripted_inference': False,                    # Self-play evaluates a frozen TorchScript trace of the model
+    'quantized_inference': False,                   # Self-play evaluates with dynamic int8 Linear layers
+    'quantization_kl_tolerance': 1e-3,              # Max policy KL (nats) from fp32 before self-play keeps fp32
+    'eval_cache_size': 0,                           # Max cached model evaluations per trainer (0 disables)
+    'numItersForTrainExamplesHistory': 20,          # Self-play iterations kept in the replay buffer
+    'replay_buffer_size': 50000,                    # Max examples kept in the replay buffer
+    'example_store_path': None,                     # Directory to persist every self-play example to (None disables)
+    'pack_states': False,                           # Keep MCTS node states as 4-bit packed boards to save memory
+    'transposition_table_size': 0,                  # Max positions shared between transpositions in MCTS (0 disables)
+    'array_tree': False,                            # Use the array-backed MCTS engine instead of Node objects (needs reuse_tree off)
     'epochs': 2,                                    # Number of epochs of training per iteration
+    'lr': 5e-4,                                     # Adam learning rate
+    'effective_batch_size': 64,                     # Examples per optimizer step, accumulated over batch_size batches
+    'bf16': False,                                  # Run the forward pass under bfloat16 autocast
+    'prefetch_batches': 2,                          # Training batches prepared ahead on a background thread
     'checkpoint_path': 'latest.pth'                 # location to save latest set of weights
 }
 
-game = AppleGame()
-board_size = game.get_board_size()
-action_size = game.get_action_size()
+if __name__ == '__main__':
+    # Guarded so that spawned self-play workers can import this module without starting training
+    game = AppleGame(args['rows'], args['cols'])
+    board_size = game.get_board_size()
+    action_size = game.get_action_size()
 
-model = AppleGameModel(board_size, action_size, device)
+    model = AppleGameModel(board_size, action_size, device, policy_head=args['policy_head'], game=game)
 
-trainer = Trainer(game, model, args)
-trainer.learn()
+    trainer = Trainer(game, model, args)
+    trainer.learn()
@@ -1,45 +1,190 @@
 import numpy as np
+from collections import OrderedDict
 
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
 
+class CornerPolicyHead(nn.Module):
+    """
+    Scores each action's rectangle as the dot product of an embedding of its top-left cell
+    and an embedding of its bottom-right cell. The layer grows with the number of cells, O(R*C),
+    instead of the number of rectangles, O(R^2*C^2). Given a valid_moves mask, only legal
+    rectangles are scored and the rest get -inf.
+    """
+
+    def __init__(self, in_features: int, rows: int, cols: int, action_to_range, embedding_dim=8):
+
+        super(CornerPolicyHead, self).__init__()
+
+        self.num_cells = rows * cols
+        self.embedding_dim = embedding_dim
+        self.corners = nn.Linear(in_features=in_features, out_features=2 * self.num_cells * embedding_dim)
+
+        ranges = torch.as_tensor(np.asarray(action_to_range), dtype=torch.long)
+        start_cells = ranges[:, 0] * cols + ranges[:, 1]
+        end_cells = ranges[:, 2] * cols + ranges[:, 3]
+        # Derived from the game, so they are rebuilt rather than stored in checkpoints
+        self.register_buffer('start_cells', start_cells, persistent=False)
+        self.register_buffer('end_cells', end_cells, persistent=False)
+        self.register_buffer('pair_index', start_cells * self.num_cells + end_cells, persistent=False)
+
+    def forward(self, x, valid_moves=None):
+        corners = self.corners(x).view(-1, 2, self.num_cells, self.embedding_dim) / self.embedding_dim ** 0.5
+        top_left, bottom_right = corners[:, 0], corners[:, 1]
+
+        if valid_moves is None:
+            # Every pair of cells in one batched matmul, then the pairs that form a rectangle
+            pairs = torch.bmm(top_left, bottom_right.transpose(1, 2)).flatten(1)
+            return pairs.index_select(1, self.pair_index)
+
+        boards, actions = valid_moves.nonzero(as_tuple=True)
+        legal = (top_left[boards, self.start_cells[actions]] * bottom_right[boards, self.end_cells[actions]]).sum(-1)
+        logits = torch.full(valid_moves.shape, float('-inf'), dtype=legal.dtype, device=legal.device)
+        return logits.index_put((boards, actions), legal)
+
+
 class AppleGameModel(nn.Module):
 
-    def __init__(self, board_size: int, action_size: int, device: torch.device):
+    def __init__(self, board_size: int, action_size: int, device: torch.device, policy_head='dense', game=None):
+        """
+        policy_head is 'dense', one output per action, or 'corner', a CornerPolicyHead built
+        from game's board shape and action table.
+        """
 
         super(AppleGameModel, self).__init__()
 
         self.device = device
         self.size = board_size
         self.action_size = action_size
+        self.policy_head = policy_head
 
         self.fc1 = nn.Linear(in_features=self.size, out_features=16)
         self.fc2 = nn.Linear(in_features=16, out_features=16)
 
         # Two heads on our network
-        self.action_head = nn.Linear(in_features=16, out_features=self.action_size)
+        if policy_head == 'corner':
+            self.action_head = CornerPolicyHead(16, game.ROWS, game.COLS, game.action_to_range)
+        elif policy_head == 'dense':
+            self.action_head = nn.Linear(in_features=16, out_features=self.action_size)
+        else:
+            raise ValueError(f"Unknown policy head {policy_head!r}")
         self.value_head = nn.Linear(in_features=16, out_features=1)
 
         self.to(device)
 
-    def forward(self, x):
+    def forward(self, x, valid_moves=None):
+        """
+        Policy log-probabilities and values. With a valid_moves mask the log-softmax runs over
+        the legal actions only and illegal actions get -inf.
+        """
         x = F.relu(self.fc1(x))
         x = F.relu(self.fc2(x))
 
-        action_logits = self.action_head(x)
+        if self.policy_head == 'corner':
+            # Scores legal actions only; the rest are already -inf
+            action_logits = self.action_head(x, valid_moves)
+        else:
+            action_logits = self.action_head(x)
+            if valid_moves is not None:
+                action_logits = action_logits.masked_fill(~valid_moves.bool(), float('-inf'))
 
         value_logit = self.value_head(x)
         value_logit = torch.sigmoid(value_logit) * self.size
 
-        return F.softmax(action_logits, dim=1), value_logit
+        return F.log_softmax(action_logits, dim=1), value_logit
+
+    def predict(self, board, valid_moves=None):
+        """
+        Policy and value of one board. Given the board's valid_moves mask, the policy is
+        normalized over the legal actions and zero everywhere else.
+        """
+        pis, vs = self.predict_batch(np.asarray(board, dtype=np.float32)[None],
+                                     None if valid_moves is None else np.asarray(valid_moves)[None])
+        return pis[0], vs[0]
 
-    def predict(self, board):
-        board = torch.FloatTensor(board.astype(np.float32)).to(self.device)
-        board = board.view(1, self.size)
+    def predict_batch(self, boards, valid_moves=None):
+        boards = torch.from_numpy(np.asarray(boards, dtype=np.float32)).to(self.device)
+        boards = boards.view(-1, self.size)
+        if valid_moves is not None:
+            valid_moves = torch.from_numpy(np.asarray(valid_moves, dtype=bool)).to(self.device)
         self.eval()
         with torch.no_grad():
-            pi, v = self.forward(board)
+            log_pi, v = self.forward(boards, valid_moves)
+
+        return log_pi.exp().cpu().numpy(), v.cpu().numpy()
+
+
+class EvaluationCache:
+    """
+    Bounded LRU cache of predict results in front of a model, keyed by the board bytes and the
+    model version. invalidate() must be called whenever the model's weights change.
+    """
+
+    def __init__(self, model: AppleGameModel, capacity):
+        self.model = model
+        self.capacity = capacity
+        self.version = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, board):
+        return self.version, np.asarray(board, dtype=np.uint8).tobytes()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, pi, v):
+        # Cached arrays are shared by every caller, so make sure nobody modifies them in place
+        pi.setflags(write=False)
+        v.setflags(write=False)
+        self.entries[key] = (pi, v)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def predict(self, board, valid_moves=None):
+        # The legal moves follow from the board, so the board alone is a complete key as long
+        # as callers consistently pass valid_moves (MCTS always does)
+        key = self.key(board)
+        entry = self.get(key)
+        if entry is None:
+            entry = self.model.predict(board, valid_moves)
+            self.put(key, *entry)
+        return entry
+
+    def predict_batch(self, boards, valid_moves=None):
+        keys = [self.key(board) for board in boards]
+        entries = [self.get(key) for key in keys]
+        missing = [i for i, entry in enumerate(entries) if entry is None]
+        if missing:
+            pis, vs = self.model.predict_batch(np.stack([np.asarray(boards[i]) for i in missing]),
+                                               None if valid_moves is None else np.asarray(valid_moves)[missing])
+            for i, pi, v in zip(missing, pis, vs):
+                entries[i] = (pi.copy(), v.copy())
+                self.put(keys[i], *entries[i])
+        return np.stack([pi for pi, _ in entries]), np.stack([v for _, v in entries])
+
+    def invalidate(self):
+        self.version += 1
+        self.entries.clear()
 
-        return pi.data.cpu().numpy()[0], v.data.cpu().numpy()[0]
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'version': self.version,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -1,8 +1,10 @@
 import torch
 import math
+import time
 import numpy as np
+from collections import OrderedDict
 from model import AppleGameModel
-from game import AppleGame
+from game import AppleGame, AppleBoard, CompactAppleBoard, PackedBoard
 
 from time_analysis import timer, TimerContext
 
@@ -14,6 +16,8 @@ def ucb_score(parent, child):
 
 
 class Node:
+    __slots__ = ('visit_count', 'prior', 'value', 'children', 'state')
+
     def __init__(self, prior):
         self.visit_count = 0
         self.prior = prior
@@ -80,55 +84,235 @@ class Node:
         return "{} Prior: {} Count: {} Value: {}".format(self.state.__str__(), prior, self.visit_count, self.value())
 
 
+class TranspositionTable:
+    """
+    Bounded LRU map from a packed board to the node expanded for it and its value,
+    so positions reached through different move orders share one evaluation and subtree.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries: OrderedDict[PackedBoard, tuple[Node, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_evaluations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key: PackedBoard):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        node, _ = entry
+        if node.expanded():
+            # Terminal positions never reach the network, so only expanded hits save a call
+            self.saved_evaluations += 1
+        return entry
+
+    def put(self, key: PackedBoard, node: Node, value):
+        self.entries[key] = (node, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'saved_evaluations': self.saved_evaluations,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
 class MCTS:
 
     def __init__(self, game: AppleGame, model: AppleGameModel, args):
         self.game = game
         self.model = model
         self.args = args
+        # Store node states as PackedBoard instead of full ndarrays to shrink the tree
+        self.pack_states = args.get('pack_states', False)
+        # Share evaluations and subtrees between transpositions, capped at this many positions
+        table_size = args.get('transposition_table_size', 0)
+        self.transpositions = TranspositionTable(table_size) if table_size else None
 
-    # @timer
-    def run(self, model: AppleGameModel, state: np.ndarray):
+    def store_state(self, state):
+        # A full AppleBoard is ~8x the size of its board; nodes keep the board and a bit mask
+        if isinstance(state, AppleBoard):
+            return state.compact(pack_board=self.pack_states)
+        if self.pack_states:
+            return PackedBoard.from_array(state)
+        return state
 
-        root = Node(0)
+    def load_state(self, state):
+        if isinstance(state, CompactAppleBoard):
+            return state.load(self.game)
+        if isinstance(state, PackedBoard):
+            return state.to_array()
+        return state
 
-        # EXPAND root
-        action_probs, value = model.predict(state)
-        valid_moves = self.game.get_valid_moves(state)
-        action_probs = action_probs * valid_moves  # mask invalid moves
-        action_probs /= np.sum(action_probs)
-        root.expand(state, action_probs)
+    # @timer
+    def run(self, model: AppleGameModel, state: np.ndarray, root: Node = None):
+        """
+        Search from state. If root is an already expanded node for state, such as the chosen
+        child of the previous search, its subtree is kept and only the visits it is missing
+        from the num_simulations budget are simulated.
+        """
+        start_time = time.perf_counter()
 
-        for _ in range(self.args['num_simulations']):
-            node = root
-            search_path = [node]
+        if root is None or not root.expanded():
+            root = Node(0)
 
-            # SELECT
-            while node.expanded():
-                action, node = node.select_child()
-                search_path.append(node)
+            # EXPAND root
+            self.evaluate(model, root, state)
+        reused_visits = root.visit_count
+        num_simulations = max(self.args['num_simulations'] - reused_visits, 0)
 
-            parent = search_path[-2]
-            state = parent.state
-            # Now we're at a leaf node and we would like to expand
-            # Players always play from their own perspective
-            next_state = self.game.get_next_state(state, action=action)
-
-            # The value of the new state from the perspective of the other player
-            value = self.game.get_score(next_state)
-            if self.game.has_legal_moves(next_state):
-                # If the game has not ended:
-                # EXPAND
-                action_probs, value = model.predict(next_state)
-                valid_moves = self.game.get_valid_moves(next_state)
-                action_probs = action_probs * valid_moves  # mask invalid moves
-                action_probs /= np.sum(action_probs)
-                node.expand(next_state, action_probs)
+        leaf_batch_size = self.args.get('leaf_batch_size', 1)
+        if leaf_batch_size > 1:
+            self.search_batched(model, root, leaf_batch_size, num_simulations)
+        else:
+            for _ in range(num_simulations):
+                # SELECT
+                search_path, action = self.select_leaf(root)
+                node = search_path[-1]
 
-            self.backpropagate(search_path, value)
+                parent = search_path[-2]
+                state = self.load_state(parent.state)
+                # Now we're at a leaf node and we would like to expand
+                # Players always play from their own perspective
+                next_state = self.game.get_next_state(state, action=action)
+
+                value = self.evaluate(model, node, next_state)
+                self.backpropagate(search_path, value)
 
+        elapsed = time.perf_counter() - start_time
+        self.search_stats = {
+            'num_simulations': num_simulations,
+            'reused_visits': reused_visits,
+            'leaf_batch_size': leaf_batch_size,
+            'leaves_per_sec': num_simulations / elapsed if elapsed > 0 else float('inf'),
+        }
         return root
 
+    def select_leaf(self, root: Node):
+        node = root
+        search_path = [node]
+        action = None
+        while node.expanded():
+            action, node = node.select_child()
+            search_path.append(node)
+        return search_path, action
+
+    def search_batched(self, model: AppleGameModel, root: Node, leaf_batch_size, num_simulations):
+        """
+        Run the simulations in rounds of up to leaf_batch_size leaves evaluated in one forward pass.
+        Virtual visits added along each pending path steer the following descents elsewhere.
+        """
+        virtual_loss = self.args.get('virtual_loss', 1)
+        simulations = 0
+        while simulations < num_simulations:
+            paths, leaves, states = [], [], []
+            while len(leaves) < min(leaf_batch_size, num_simulations - simulations):
+                search_path, action = self.select_leaf(root)
+                node = search_path[-1]
+                if any(node is leaf for leaf in leaves):
+                    # Every descent now collides with a pending leaf; evaluate what we have
+                    break
+
+                for path_node in search_path:
+                    path_node.visit_count += virtual_loss
+
+                parent = search_path[-2]
+                paths.append(search_path)
+                leaves.append(node)
+                states.append(self.game.get_next_state(self.load_state(parent.state), action=action))
+
+            values = self.evaluate_batch(model, leaves, states)
+            for search_path, value in zip(paths, values):
+                for path_node in search_path:
+                    path_node.visit_count -= virtual_loss
+                self.backpropagate(search_path, value)
+            simulations += len(leaves)
+
+    def lookup(self, node: Node, state):
+        """
+        Look the position up in the transposition table. On a hit, node shares the stored subtree.
+        """
+        if self.transpositions is None:
+            return None, None
+        key = PackedBoard.from_array(state)
+        entry = self.transpositions.get(key)
+        if entry is not None:
+            shared, _ = entry
+            node.state = shared.state
+            node.children = shared.children
+        return key, entry
+
+
+    def evaluate(self, model: AppleGameModel, node: Node, state):
+        """
+        Expand node with the position state and return the value to back up.
+        """
+        key, entry = self.lookup(node, state)
+        if entry is not None:
+            return entry[1]
+
+        # The value of the new state from the perspective of the other player
+        value = self.game.get_score(state)
+        if self.game.has_legal_moves(state):
+            # If the game has not ended:
+            # EXPAND
+            # The model normalizes its priors over the legal moves
+            action_probs, value = model.predict(state, self.game.get_valid_moves(state))
+            node.expand(self.store_state(state), action_probs)
+
+        if key is not None:
+            self.transpositions.put(key, node, value)
+        return value
+
+    def evaluate_batch(self, model: AppleGameModel, nodes: list[Node], states):
+        """
+        Like evaluate for several leaves, with every network evaluation done in one predict_batch call.
+        """
+        values = []
+        keys = []
+        pending = []
+        for i, (node, state) in enumerate(zip(nodes, states)):
+            key, entry = self.lookup(node, state)
+            if entry is not None:
+                keys.append(None)
+                values.append(entry[1])
+                continue
+
+            keys.append(key)
+            values.append(self.game.get_score(state))
+            if self.game.has_legal_moves(state):
+                pending.append(i)
+
+        if pending:
+            boards = np.stack([np.asarray(states[i], dtype=np.float32) for i in pending])
+            valid_moves = np.stack([self.game.get_valid_moves(states[i]) for i in pending])
+            action_probs, predicted_values = model.predict_batch(boards, valid_moves)
+            for i, probs, value in zip(pending, action_probs, predicted_values):
+                nodes[i].expand(self.store_state(states[i]), probs)
+                values[i] = value
+
+        for node, key, value in zip(nodes, keys, values):
+            if key is not None:
+                self.transpositions.put(key, node, value)
+        return values
+
     def backpropagate(self, search_path: list[Node], value):
         """
         At the end of a simulation, we propagate the evaluation all the way up the tree
@@ -139,3 +323,144 @@ class MCTS:
             if node.expanded():
                 value_sum = sum([child.value for child in node.children.values()])
                 node.value = value_sum/len(node.children)
+
+
+class ArrayMCTS(MCTS):
+    """
+    MCTS with the tree stored as a struct of preallocated NumPy arrays instead of Node objects.
+    The children of a node occupy a contiguous slice, so child selection is one vectorized
+    argmax. run returns the root statistics as a Node, like MCTS.run.
+    Transposition tables, batched leaf evaluation and subtree reuse are not supported by this
+    engine; args that ask for them raise ValueError. reuse_tree defaults to on, as in Trainer,
+    so it has to be set to False explicitly.
+    """
+
+    def __init__(self, game: AppleGame, model: AppleGameModel, args):
+        unsupported = [name for name, requested in [
+            ('transposition_table_size', args.get('transposition_table_size', 0) > 0),
+            ('leaf_batch_size', args.get('leaf_batch_size', 1) > 1),
+            ('reuse_tree', args.get('reuse_tree', True)),
+        ] if requested]
+        if unsupported:
+            raise ValueError(f"ArrayMCTS does not support {', '.join(unsupported)}; "
+                             f"disable them or use MCTS")
+        super().__init__(game, model, args)
+        self.allocate_tree(args.get('tree_capacity', 1 << 16))
+
+    def allocate_tree(self, capacity):
+        self.capacity = capacity
+        self.size = 0
+        self.prior = np.zeros(capacity, dtype=np.float64)
+        self.visit_count = np.zeros(capacity, dtype=np.int64)
+        self.value = np.zeros(capacity, dtype=np.float64)
+        self.action = np.zeros(capacity, dtype=np.intp)
+        self.first_child = np.zeros(capacity, dtype=np.intp)
+        self.num_children = np.zeros(capacity, dtype=np.intp)
+        self.states = [None] * capacity
+
+    def reset_tree(self):
+        used = self.size
+        self.visit_count[:used] = 0
+        self.value[:used] = 0
+        self.num_children[:used] = 0
+        self.states[:used] = [None] * used
+        self.size = 0
+
+    def new_nodes(self, count):
+        """
+        Reserve count consecutive node slots and return the index of the first one.
+        """
+        if self.size + count > self.capacity:
+            capacity = max(2 * self.capacity, self.size + count)
+            for name in ['prior', 'visit_count', 'value', 'action', 'first_child', 'num_children']:
+                old = getattr(self, name)
+                grown = np.zeros(capacity, dtype=old.dtype)
+                grown[:self.size] = old[:self.size]
+                setattr(self, name, grown)
+            self.states.extend([None] * (capacity - self.capacity))
+            self.capacity = capacity
+
+        start = self.size
+        self.size += count
+        return start
+
+    def expand(self, index, state, action_probs):
+        actions = np.nonzero(action_probs)[0]
+        start = self.new_nodes(len(actions))
+        end = start + len(actions)
+        self.action[start:end] = actions
+        self.prior[start:end] = action_probs[actions]
+        self.first_child[index] = start
+        self.num_children[index] = len(actions)
+        self.states[index] = self.store_state(state)
+
+    def select_child(self, index):
+        start = self.first_child[index]
+        end = start + self.num_children[index]
+        scores = self.prior[start:end] * math.sqrt(self.visit_count[index]) / (self.visit_count[start:end] + 1)
+        return start + int(np.argmax(scores))
+
+    def run(self, model: AppleGameModel, state: np.ndarray, root: Node = None):
+        # The tree is rebuilt on every call, so a root carried over from the last search is ignored
+        start_time = time.perf_counter()
+        self.reset_tree()
+        root = self.new_nodes(1)
+
+        # EXPAND root
+        self.evaluate(model, root, state)
+
+        for _ in range(self.args['num_simulations']):
+            index = root
+            search_path = [index]
+
+            # SELECT
+            while self.num_children[index] > 0:
+                index = self.select_child(index)
+                search_path.append(index)
+
+            parent = search_path[-2]
+            state = self.load_state(self.states[parent])
+            next_state = self.game.get_next_state(state, action=self.action[index])
+
+            value = self.evaluate(model, index, next_state)
+            self.backpropagate(search_path, value)
+
+        elapsed = time.perf_counter() - start_time
+        self.search_stats = {
+            'num_simulations': self.args['num_simulations'],
+            'reused_visits': 0,
+            'leaf_batch_size': 1,
+            'leaves_per_sec': self.args['num_simulations'] / elapsed if elapsed > 0 else float('inf'),
+        }
+        return self.root_node(root)
+
+    def evaluate(self, model: AppleGameModel, index, state):
+        value = self.game.get_score(state)
+        if self.game.has_legal_moves(state):
+            action_probs, value = model.predict(state, self.game.get_valid_moves(state))
+            self.expand(index, state, action_probs)
+        return value
+
+    def backpropagate(self, search_path, value):
+        self.visit_count[search_path] += 1
+        for index in reversed(search_path):
+            if self.num_children[index] > 0:
+                start = self.first_child[index]
+                self.value[index] = self.value[start:start + self.num_children[index]].mean()
+
+    def root_node(self, index):
+        """
+        Copy the statistics of a node and its children into a Node for the trainer.
+        """
+        node = Node(self.prior[index])
+        node.visit_count = int(self.visit_count[index])
+        node.value = self.value[index]
+        node.state = self.states[index]
+        start = self.first_child[index]
+        for child in range(start, start + self.num_children[index]):
+            child_node = Node(self.prior[child])
+            child_node.visit_count = int(self.visit_count[child])
+            child_node.value = self.value[child]
+            child_node.state = self.states[child]
+            node.children[int(self.action[child])] = child_node
+        return node
@@ -0,0 +1,94 @@
+from collections import deque
+
+import numpy as np
+
+
+def sparse_policy(policy, max_policy_size):
+    """
+    (indices, probabilities) of a dense or already sparse policy, padded with zero probabilities
+    to max_policy_size entries. Wider policies keep their most likely actions, renormalized.
+    """
+    if isinstance(policy, tuple):
+        indices, probs = (np.asarray(p) for p in policy)
+    else:
+        indices = np.flatnonzero(policy)
+        probs = np.asarray(policy)[indices]
+
+    if len(indices) > max_policy_size:
+        keep = np.argsort(probs)[-max_policy_size:]
+        indices, probs = indices[keep], probs[keep] / probs[keep].sum()
+
+    padded_indices = np.zeros(max_policy_size, dtype=np.int32)
+    padded_probs = np.zeros(max_policy_size, dtype=np.float32)
+    padded_indices[:len(indices)] = indices
+    padded_probs[:len(probs)] = probs
+    return padded_indices, padded_probs
+
+
+class ReplayBuffer:
+    """
+    Training examples from the last num_iterations self-play iterations, capped at capacity
+    examples and kept in preallocated NumPy ring arrays. Policies are stored sparsely as
+    max_policy_size (index, probability) pairs per example.
+    """
+
+    def __init__(self, capacity, board_shape, max_policy_size, num_iterations):
+        self.capacity = capacity
+        self.num_iterations = num_iterations
+        self.max_policy_size = max_policy_size
+        self.boards = np.zeros((capacity,) + tuple(board_shape), dtype=np.uint8)
+        self.pi_indices = np.zeros((capacity, max_policy_size), dtype=np.int32)
+        self.pi_probs = np.zeros((capacity, max_policy_size), dtype=np.float32)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+
+        # The examples live at positions start, start+1, ... start+size-1 (mod capacity)
+        self.start = 0
+        self.size = 0
+        self.iteration_sizes = deque()
+
+    def __len__(self):
+        return self.size
+
+    def drop_oldest(self, count):
+        self.start = (self.start + count) % self.capacity
+        self.size -= count
+        while count > 0:
+            dropped = min(count, self.iteration_sizes[0])
+            self.iteration_sizes[0] -= dropped
+            count -= dropped
+            if self.iteration_sizes[0] == 0:
+                self.iteration_sizes.popleft()
+
+    def add_iteration(self, examples):
+        """
+        Append one iteration of (board, policy, reward) examples, forgetting the oldest
+        iteration once num_iterations are held and the oldest examples once full.
+        """
+        while len(self.iteration_sizes) >= self.num_iterations:
+            self.drop_oldest(self.iteration_sizes[0])
+
+        examples = examples[-self.capacity:]
+        if not examples:
+            return
+        boards, policies, rewards = zip(*examples)
+        pi_indices, pi_probs = zip(*(sparse_policy(policy, self.max_policy_size) for policy in policies))
+
+        overflow = self.size + len(examples) - self.capacity
+        if overflow > 0:
+            self.drop_oldest(overflow)
+
+        index = (self.start + self.size + np.arange(len(examples))) % self.capacity
+        self.boards[index] = np.stack(boards)
+        self.pi_indices[index] = np.stack(pi_indices)
+        self.pi_probs[index] = np.stack(pi_probs)
+        self.rewards[index] = rewards
+        self.size += len(examples)
+        self.iteration_sizes.append(len(examples))
+
+    def sample(self, batch_size):
+        """
+        Uniformly sample batch_size examples with replacement as
+        (boards, pi_indices, pi_probs, rewards) arrays.
+        """
+        index = (self.start + np.random.randint(self.size, size=batch_size)) % self.capacity
+        return self.boards[index], self.pi_indices[index], self.pi_probs[index], self.rewards[index]
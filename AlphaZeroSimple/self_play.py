@@ -0,0 +1,171 @@
+import queue
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from game import AppleGame
+from model import AppleGameModel, EvaluationCache
+from inference_server import InferenceServer
+from export import ScriptedPredictor, check_policy_kl, quantize
+
+
+def cpu_state_dict(model: AppleGameModel):
+    return {k: v.detach().cpu() for k, v in model.state_dict().items()}
+
+
+def worker_model(game: AppleGame, args, state_dict):
+    """
+    A CPU model with the given weights. With args['quantized_inference'] its Linear layers
+    are quantized to int8, unless that moves the policy more than quantization_kl_tolerance
+    away from the fp32 model. With args['scripted_inference'] it is traced into an
+    inference-only ScriptedPredictor.
+    """
+    model = AppleGameModel(game.get_board_size(), game.get_action_size(), torch.device('cpu'),
+                           policy_head=args.get('policy_head', 'dense'), game=game)
+    model.load_state_dict(state_dict)
+    if args.get('quantized_inference', False):
+        quantized = quantize(model)
+        boards = np.stack([game.get_init_board() for _ in range(32)])
+        try:
+            check_policy_kl(model, quantized, boards, game.get_valid_moves_batch(boards),
+                            tolerance=args.get('quantization_kl_tolerance', 1e-3))
+            model = quantized
+        except ValueError as e:
+            print(f"Self-play falls back to the fp32 model: {e}")
+    if args.get('scripted_inference', False):
+        return ScriptedPredictor.from_model(model)
+    return model
+
+
+def self_play_worker(worker_id, trainer_class, args, state_dict, tasks, results, weights, client=None):
+    """
+    Play episodes until a None task arrives, either with a private CPU copy of the model
+    or, if client is given, by sending every evaluation to a shared InferenceServer.
+    """
+    # One interpreter per core scales better than intra-op threads fighting over cores
+    torch.set_num_threads(1)
+    # Forked workers inherit the parent's RNG state; reseed so their games differ
+    np.random.seed()
+
+    game = AppleGame(args.get('rows', 10), args.get('cols', 17))
+    model = client if client is not None else worker_model(game, args, state_dict)
+    trainer = trainer_class(game, model, args)
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+
+        # Pick up the newest weights published since the last episode
+        updated = False
+        while True:
+            try:
+                state_dict = weights.get_nowait()
+                updated = True
+            except queue.Empty:
+                break
+        if updated:
+            if client is None:
+                # A fresh trainer also starts with an empty evaluation cache
+                trainer = trainer_class(game, worker_model(game, args, state_dict), args)
+            else:
+                trainer.reset_evaluation_cache()
+
+        examples = trainer.exceute_episode()
+        cache_stats = trainer.evaluator.stats() if isinstance(trainer.evaluator, EvaluationCache) else None
+        results.put((worker_id, examples, trainer.mcts.search_stats, cache_stats))
+
+
+class SelfPlayPool:
+    """
+    Runs Trainer.exceute_episode in worker processes, each with its own CPU copy of the model,
+    or with args['inference_server'] set, all sharing the trainer's model through one
+    InferenceServer that batches their requests.
+    """
+
+    def __init__(self, trainer, num_workers):
+        self.num_workers = num_workers
+        self.search_stats = {}
+        # Latest EvaluationCache.stats() of each worker that has a cache
+        self.cache_stats = {}
+
+        context = mp.get_context(trainer.args.get('start_method', 'spawn'))
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.weights = [context.Queue() for _ in range(num_workers)]
+
+        self.inference_server = None
+        if trainer.args.get('inference_server', False):
+            self.inference_server = InferenceServer(trainer.model, num_workers, context,
+                                                    max_batch_size=trainer.args.get('inference_batch_size', 64),
+                                                    timeout=trainer.args.get('inference_timeout', 0.002))
+            self.inference_server.start()
+            state_dict = None
+        else:
+            state_dict = cpu_state_dict(trainer.model)
+
+        self.workers = [
+            context.Process(target=self_play_worker,
+                            args=(i, type(trainer), trainer.args, state_dict,
+                                  self.tasks, self.results, self.weights[i],
+                                  self.inference_server.client(i) if self.inference_server else None),
+                            daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def play(self, num_episodes):
+        """
+        Yield the examples of each episode as soon as a worker finishes it.
+        """
+        for _ in range(num_episodes):
+            self.tasks.put(True)
+
+        for _ in range(num_episodes):
+            while True:
+                try:
+                    worker_id, examples, self.search_stats, cache_stats = self.results.get(timeout=1)
+                    if cache_stats is not None:
+                        self.cache_stats[worker_id] = cache_stats
+                    break
+                except queue.Empty:
+                    dead = [worker for worker in self.workers if worker.exitcode not in (None, 0)]
+                    if dead:
+                        raise RuntimeError(f"Self-play worker exited with code {dead[0].exitcode}")
+                    if self.inference_server is not None and not self.inference_server.thread.is_alive():
+                        raise RuntimeError("Inference server thread stopped")
+            yield examples
+
+    def evaluation_cache_stats(self):
+        """
+        Evaluation cache counters summed over the workers, or None if they run without a cache.
+        Each worker's counters restart with the cache it builds for new weights.
+        """
+        if not self.cache_stats:
+            return None
+        totals = {key: sum(stats[key] for stats in self.cache_stats.values())
+                  for key in ['size', 'hits', 'misses', 'evictions']}
+        lookups = totals['hits'] + totals['misses']
+        totals['hit_rate'] = totals['hits'] / lookups if lookups else 0.0
+        totals['workers'] = len(self.cache_stats)
+        return totals
+
+    def update_weights(self, model: AppleGameModel):
+        """
+        Publish new weights; each worker loads them before its next episode.
+        """
+        # The inference server evaluates with the trainer's model, which already holds the new
+        # weights; its workers only need to hear about the change to drop cached evaluations
+        state_dict = cpu_state_dict(model) if self.inference_server is None else None
+        for weights in self.weights:
+            weights.put(state_dict)
+
+    def close(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+        if self.inference_server is not None:
+            self.inference_server.stop()
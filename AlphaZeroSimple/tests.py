@@ -1,7 +1,18 @@
 import numpy as np
+import torch
 import unittest
-from monte_carlo_tree_search import Node, MCTS, ucb_score
-from game import AppleGame
+from monte_carlo_tree_search import Node, MCTS, ArrayMCTS, TranspositionTable, ucb_score
+from game import AppleGame, AppleBoard, CompactAppleBoard, PackedBoard
+from model import AppleGameModel, EvaluationCache
+from trainer import Trainer
+from self_play import SelfPlayPool, worker_model
+from inference_server import InferenceServer
+from replay_buffer import ReplayBuffer, sparse_policy
+from example_store import ExampleStore
+from data_loader import BatchLoader
+from export import (ScriptedPredictor, check_policy_kl, load_puzzle_net_class, policy_kl, quantize, save,
+                    trace_apple_game_model, trace_puzzle_net)
+from benchmark import get_valid_moves_loop, state_bytes
 
 
 class MCTSTests(unittest.TestCase):
@@ -82,6 +93,7 @@ class MCTSTests(unittest.TestCase):
         self.assertGreater(root.children[1].visit_count, root.children[2].visit_count)
         self.assertGreater(root.children[1].visit_count, root.children[3].visit_count)
 
+
 class NodeTests(unittest.TestCase):
 
     def test_initialization(self):
@@ -237,6 +249,1007 @@ class NodeTests(unittest.TestCase):
         self.assertEqual(score_3, node.children[3].prior)
 
 
+class AppleGameTests(unittest.TestCase):
+
+    def random_board(self, game, rng, zero_fraction=0.3):
+        board = rng.integers(1, 10, size=(game.ROWS, game.COLS))
+        board[rng.random(board.shape) < zero_fraction] = 0
+        return board
+
+    def test_action_table_matches_action_size(self):
+        game = AppleGame()
+
+        self.assertEqual(game.action_to_range.shape, (game.action_size, 4))
+        self.assertTrue(np.all(game.start_rows <= game.end_rows))
+        self.assertTrue(np.all(game.start_cols <= game.end_cols))
+
+    def test_valid_moves_match_python_loop(self):
+        game = AppleGame()
+        rng = np.random.default_rng(0)
+
+        for zero_fraction in [0.0, 0.3, 0.7]:
+            board = self.random_board(game, rng, zero_fraction)
+            expected = get_valid_moves_loop(game, board)
+            valid_moves = game.get_valid_moves(board)
+
+            self.assertEqual(valid_moves.dtype, np.uint8)
+            np.testing.assert_array_equal(valid_moves, expected)
+
+    def test_custom_board_size(self):
+        game = AppleGame(rows=4, cols=6)
+        self.assertEqual(game.action_size, len(game.action_to_range))
+        self.assertEqual(game.action_size, (4 * 5 // 2) * (6 * 7 // 2))
+        board = game.get_init_board()
+        self.assertEqual(board.shape, (4, 6))
+        np.testing.assert_array_equal(game.get_valid_moves(board), get_valid_moves_loop(game, board))
+
+    def test_batch_api_matches_single_board_api(self):
+        game = AppleGame()
+        rng = np.random.default_rng(1)
+        boards = np.stack([self.random_board(game, rng, zero_fraction) for zero_fraction in [0.0, 0.2, 0.5, 0.9]])
+
+        # Mix legal and illegal actions
+        actions = []
+        for board in boards:
+            legal = np.flatnonzero(game.get_valid_moves(board))
+            actions.append(legal[0] if len(legal) else 0)
+        actions[-1] = game.action_size - 1
+        actions = np.array(actions)
+
+        next_states, valid_moves, terminals, scores = game.step_batch(boards, actions)
+
+        for i, (board, action) in enumerate(zip(boards, actions)):
+            next_state = game.get_next_state(board, action)
+            np.testing.assert_array_equal(next_states[i], next_state)
+            np.testing.assert_array_equal(valid_moves[i], game.get_valid_moves(next_state))
+            self.assertEqual(terminals[i], not game.has_legal_moves(next_state))
+            self.assertEqual(scores[i], game.get_score(next_state))
+
+        np.testing.assert_array_equal(game.has_legal_moves_batch(boards),
+                                      [game.has_legal_moves(board) for board in boards])
+
+    def test_apple_board_matches_from_scratch(self):
+        game = AppleGame()
+        rng = np.random.default_rng(2)
+
+        for _ in range(20):
+            state = AppleBoard(game, self.random_board(game, rng, zero_fraction=0.0))
+            while state.has_legal_moves():
+                legal = np.flatnonzero(state.valid_moves)
+                action = rng.choice(legal)
+                previous = state.board.copy()
+                state = game.get_next_state(state, action)
+
+                expected = game.get_next_state(previous, action)
+                np.testing.assert_array_equal(state.board, expected)
+                np.testing.assert_array_equal(state.prefix_sum, game.get_prefix_sum(expected))
+                np.testing.assert_array_equal(state.valid_moves, game.get_valid_moves(expected))
+                self.assertEqual(game.get_score(state), game.get_score(expected))
+
+            self.assertFalse(game.has_legal_moves(state.board))
+
+    def test_apple_board_illegal_action_keeps_board(self):
+        game = AppleGame()
+        state = AppleBoard(game, np.full((game.ROWS, game.COLS), 9))
+
+        self.assertFalse(state.has_legal_moves())
+        np.testing.assert_array_equal(np.asarray(game.get_next_state(state, 0)), state.board)
+
+    def test_packed_board_round_trip(self):
+        game = AppleGame()
+        rng = np.random.default_rng(3)
+        board = self.random_board(game, rng)
+
+        packed = PackedBoard.from_array(board)
+
+        self.assertEqual(len(packed.data), game.get_board_size() // 2)
+        self.assertLessEqual(len(packed.data) * 10, board.nbytes)
+        np.testing.assert_array_equal(packed.to_array(), board)
+        np.testing.assert_array_equal(np.asarray(packed, dtype=np.float32), board.astype(np.float32))
+        np.testing.assert_array_equal(PackedBoard.from_array(AppleBoard(game, board)).to_array(), board)
+
+    def test_packed_board_hash_and_equality(self):
+        game = AppleGame()
+        rng = np.random.default_rng(4)
+        board = self.random_board(game, rng)
+        other = board.copy()
+        other[0, 0] = (other[0, 0] + 1) % 10
+
+        self.assertEqual(PackedBoard.from_array(board), PackedBoard.from_array(board.copy()))
+        self.assertEqual(hash(PackedBoard.from_array(board)), hash(PackedBoard.from_array(board.copy())))
+        self.assertNotEqual(PackedBoard.from_array(board), PackedBoard.from_array(other))
+        self.assertEqual(len({PackedBoard.from_array(board), PackedBoard.from_array(board.copy())}), 1)
+
+
+class UniformModel:
+    """
+    Stand-in for AppleGameModel that returns a uniform policy and counts its calls.
+    """
+
+    def __init__(self, action_size):
+        self.action_size = action_size
+        self.calls = 0
+
+    def predict(self, board, valid_moves=None):
+        pis, vs = self.predict_batch(np.asarray(board)[None], None if valid_moves is None else valid_moves[None])
+        return pis[0], vs[0]
+
+    def predict_batch(self, boards, valid_moves=None):
+        self.calls += 1
+        pis = np.ones((len(boards), self.action_size)) if valid_moves is None else np.asarray(valid_moves, dtype=float)
+        return pis / pis.sum(axis=1, keepdims=True), np.full((len(boards), 1), 0.5)
+
+
+def training_buffer():
+    """
+    40 examples on the 10x17 board, each with a one-hot policy at the index of its reward.
+    """
+    buffer = ReplayBuffer(capacity=64, board_shape=(10, 17), max_policy_size=3, num_iterations=1)
+    buffer.add_iteration([(np.full((10, 17), i % 10), (np.array([i]), np.array([1.0])), i)
+                          for i in range(40)])
+    return buffer
+
+
+class AppleMCTSTests(unittest.TestCase):
+
+    def test_packed_states_give_same_search(self):
+        game = AppleGame()
+        board = game.get_init_board()
+
+        plain = MCTS(game, UniformModel(game.action_size), {'num_simulations': 20}).run(
+            UniformModel(game.action_size), board)
+        packed_mcts = MCTS(game, UniformModel(game.action_size), {'num_simulations': 20, 'pack_states': True})
+        packed = packed_mcts.run(UniformModel(game.action_size), board)
+
+        self.assertIsInstance(packed.state, PackedBoard)
+        np.testing.assert_array_equal(packed.state.to_array(), board)
+        self.assertEqual({a: c.visit_count for a, c in plain.children.items()},
+                         {a: c.visit_count for a, c in packed.children.items()})
+
+    def test_apple_board_states_stay_compact_and_incremental(self):
+        game = AppleGame()
+        board = game.get_init_board()
+        model = UniformModel(game.action_size)
+        plain = MCTS(game, model, {'num_simulations': 20}).run(model, board)
+
+        for pack_states in [False, True]:
+            mcts = MCTS(game, model, {'num_simulations': 20, 'pack_states': pack_states})
+            root = mcts.run(model, AppleBoard(game, board))
+
+            self.assertIsInstance(root.state, CompactAppleBoard)
+            self.assertIsInstance(root.state.board, PackedBoard if pack_states else np.ndarray)
+            # Well under the 1360 B of the int64 board a node held before AppleBoard
+            node_bytes = [state_bytes(child.state) for child in root.children.values() if child.state is not None]
+            self.assertLess(max(node_bytes), 100 if pack_states else 400)
+            # Loading gives back a full AppleBoard, so expansions keep the incremental update
+            loaded = mcts.load_state(root.state)
+            self.assertIsInstance(loaded, AppleBoard)
+            np.testing.assert_array_equal(loaded.board, board)
+            np.testing.assert_array_equal(loaded.valid_moves, game.get_valid_moves(board))
+            np.testing.assert_array_equal(loaded.prefix_sum, game.get_prefix_sum(board))
+            self.assertEqual({a: c.visit_count for a, c in plain.children.items()},
+                             {a: c.visit_count for a, c in root.children.items()})
+
+    def two_pair_board(self, game):
+        # Clearing either 1-9 pair through any rectangle covering it leads to the same board,
+        # and clearing both in either order reaches the same terminal board
+        board = np.zeros((game.ROWS, game.COLS), dtype=np.int64)
+        board[0, 0], board[0, 1] = 1, 9
+        board[-1, -1], board[-1, -2] = 1, 9
+        return board
+
+    def test_transposition_table_shares_evaluations(self):
+        game = AppleGame()
+        board = self.two_pair_board(game)
+
+        model = UniformModel(game.action_size)
+        MCTS(game, model, {'num_simulations': 50}).run(model, board)
+        calls_without_table = model.calls
+
+        model = UniformModel(game.action_size)
+        mcts = MCTS(game, model, {'num_simulations': 50, 'transposition_table_size': 100})
+        root = mcts.run(model, board)
+
+        # At most the root and the two boards with one pair left; the empty board is terminal
+        self.assertLessEqual(model.calls, 3)
+        self.assertGreater(calls_without_table, model.calls)
+        stats = mcts.transpositions.stats()
+        self.assertGreater(stats['saved_evaluations'], 0)
+        self.assertLessEqual(stats['size'], 4)
+        self.assertEqual(root.visit_count, 50)
+
+    def test_transposition_table_evicts_least_recently_used(self):
+        table = TranspositionTable(capacity=2)
+        keys = [PackedBoard.from_array(np.full((2, 2), i)) for i in range(3)]
+
+        table.put(keys[0], Node(0), 0)
+        table.put(keys[1], Node(0), 1)
+        table.get(keys[0])
+        table.put(keys[2], Node(0), 2)
+
+        self.assertIsNotNone(table.get(keys[0]))
+        self.assertIsNone(table.get(keys[1]))
+        self.assertEqual(table.evictions, 1)
+        self.assertEqual(table.stats()['hits'], 2)
+        self.assertEqual(table.stats()['misses'], 1)
+
+    def test_array_tree_matches_node_tree(self):
+        game = AppleGame()
+        rng = np.random.default_rng(5)
+        board = rng.integers(1, 10, size=(game.ROWS, game.COLS))
+
+        class RandomPriorModel:
+            def predict(self, board, valid_moves):
+                priors = np.random.default_rng(int(board.sum())).random(game.action_size) * valid_moves
+                return priors / priors.sum(), np.array([0.5])
+
+        model = RandomPriorModel()
+        args = {'num_simulations': 40, 'tree_capacity': 16, 'reuse_tree': False}
+        expected = MCTS(game, model, args).run(model, board)
+        mcts = ArrayMCTS(game, model, args)
+        root = mcts.run(model, board)
+
+        self.assertEqual(root.visit_count, expected.visit_count)
+        self.assertEqual({a: c.visit_count for a, c in root.children.items()},
+                         {a: c.visit_count for a, c in expected.children.items()})
+        self.assertGreater(mcts.capacity, 16)
+        self.assertEqual(root.select_action(temperature=0), expected.select_action(temperature=0))
+
+        # The preallocated arrays are reused by the next search
+        again = mcts.run(model, board)
+        self.assertEqual({a: c.visit_count for a, c in again.children.items()},
+                         {a: c.visit_count for a, c in expected.children.items()})
+
+    def test_array_tree_rejects_unsupported_options(self):
+        game = AppleGame()
+        model = UniformModel(game.action_size)
+        for name, args in [
+            ('transposition_table_size', {'transposition_table_size': 100, 'reuse_tree': False}),
+            ('leaf_batch_size', {'leaf_batch_size': 8, 'reuse_tree': False}),
+            ('reuse_tree', {'reuse_tree': True}),
+            # On by default, as in Trainer
+            ('reuse_tree', {}),
+        ]:
+            with self.assertRaisesRegex(ValueError, name):
+                ArrayMCTS(game, model, {'num_simulations': 4, **args})
+        ArrayMCTS(game, model, {'num_simulations': 4, 'reuse_tree': False, 'leaf_batch_size': 1,
+                                'transposition_table_size': 0})
+
+    def test_batched_leaves_use_fewer_forward_passes(self):
+        game = AppleGame()
+        board = game.get_init_board()
+        model = UniformModel(game.action_size)
+
+        mcts = MCTS(game, model, {'num_simulations': 64, 'leaf_batch_size': 8})
+        root = mcts.run(model, board)
+
+        self.assertEqual(root.visit_count, 64)
+        self.assertEqual(sum(child.visit_count for child in root.children.values()), 64)
+        # Root evaluation plus eight rounds of eight leaves
+        self.assertEqual(model.calls, 1 + 8)
+        self.assertEqual(mcts.search_stats['num_simulations'], 64)
+        self.assertGreater(mcts.search_stats['leaves_per_sec'], 0)
+
+    def test_batched_leaves_with_model(self):
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        board = game.get_init_board()
+
+        root = MCTS(game, model, {'num_simulations': 16, 'leaf_batch_size': 4}).run(model, board)
+
+        self.assertEqual(root.visit_count, 16)
+        self.assertTrue(all(game.get_valid_moves(board)[action] for action in root.children))
+
+    def test_subtree_reuse_tops_up_simulation_budget(self):
+        game = AppleGame()
+        board = np.random.default_rng(6).integers(1, 10, size=(game.ROWS, game.COLS))
+        model = UniformModel(game.action_size)
+        mcts = MCTS(game, model, {'num_simulations': 30})
+
+        root = mcts.run(model, board)
+        action = root.select_action(temperature=0)
+        child = root.children[action]
+        reused_visits = child.visit_count
+        next_board = game.get_next_state(board, action)
+        calls = model.calls
+
+        next_root = mcts.run(model, next_board, root=child)
+
+        self.assertIs(next_root, child)
+        self.assertEqual(next_root.visit_count, 30)
+        self.assertEqual(mcts.search_stats['reused_visits'], reused_visits)
+        self.assertEqual(mcts.search_stats['num_simulations'], 30 - reused_visits)
+        self.assertLessEqual(model.calls - calls, 30 - reused_visits)
+
+    def test_trainer_episode_reuses_tree(self):
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        trainer = Trainer(game, model, {'num_simulations': 4})
+
+        examples = trainer.exceute_episode()
+
+        self.assertGreater(len(examples), 0)
+        board, (actions, action_probs), reward = examples[-1]
+        self.assertEqual(board.shape, (game.ROWS, game.COLS))
+        self.assertAlmostEqual(np.sum(action_probs), 1.0, places=6)
+        self.assertTrue(np.all(action_probs > 0))
+        self.assertTrue(all(game.get_valid_moves(board)[actions]))
+        self.assertEqual(reward, examples[0][2])
+
+
+class SelfPlayPoolTests(unittest.TestCase):
+
+    def test_pool_streams_episodes_and_reloads_weights(self):
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        trainer = Trainer(game, model, {'num_simulations': 2})
+        pool = SelfPlayPool(trainer, num_workers=2)
+        try:
+            episodes = list(pool.play(3))
+            with torch.no_grad():
+                # Small enough that no legal prior underflows to zero
+                for parameter in model.parameters():
+                    parameter.add_(0.01)
+            pool.update_weights(model)
+            episodes.extend(pool.play(2))
+        finally:
+            pool.close()
+
+        self.assertEqual(len(episodes), 5)
+        for examples in episodes:
+            self.assertGreater(len(examples), 0)
+            self.assertEqual(examples[0][0].shape, (game.ROWS, game.COLS))
+        self.assertIn('leaves_per_sec', pool.search_stats)
+        self.assertTrue(all(worker.exitcode == 0 for worker in pool.workers))
+
+    def test_pool_with_inference_server(self):
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        trainer = Trainer(game, model, {'num_simulations': 2, 'inference_server': True})
+        pool = SelfPlayPool(trainer, num_workers=2)
+        try:
+            episodes = list(pool.play(2))
+        finally:
+            pool.close()
+
+        self.assertEqual(len(episodes), 2)
+        self.assertGreater(pool.inference_server.stats()['requests'], 0)
+
+    def test_pool_reports_worker_cache_stats(self):
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        trainer = Trainer(game, model, {'num_simulations': 4, 'eval_cache_size': 100})
+        pool = SelfPlayPool(trainer, num_workers=2)
+        try:
+            list(pool.play(2))
+        finally:
+            pool.close()
+
+        stats = pool.evaluation_cache_stats()
+        self.assertGreater(stats['hits'] + stats['misses'], 0)
+        self.assertLessEqual(stats['workers'], 2)
+        self.assertEqual(trainer.evaluator.stats()['misses'], 0)
+
+    def test_pool_fails_instead_of_hanging_when_inference_server_stops(self):
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        trainer = Trainer(game, model, {'num_simulations': 2, 'inference_server': True})
+        pool = SelfPlayPool(trainer, num_workers=1)
+        try:
+            pool.inference_server.stop()
+            with self.assertRaises(RuntimeError):
+                list(pool.play(1))
+        finally:
+            pool.close()
+
+    def test_pool_with_scripted_inference(self):
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        trainer = Trainer(game, model, {'num_simulations': 2, 'scripted_inference': True})
+        pool = SelfPlayPool(trainer, num_workers=2)
+        try:
+            episodes = list(pool.play(2))
+            pool.update_weights(model)
+            episodes.extend(pool.play(2))
+        finally:
+            pool.close()
+
+        self.assertEqual(len(episodes), 4)
+        self.assertTrue(all(worker.exitcode == 0 for worker in pool.workers))
+
+
+class InferenceServerTests(unittest.TestCase):
+
+    def test_batches_requests_from_concurrent_clients(self):
+        import multiprocessing
+        import threading
+
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        server = InferenceServer(model, num_clients=4, context=multiprocessing.get_context('spawn'),
+                                 max_batch_size=8, timeout=0.05)
+        boards = [game.get_init_board() for _ in range(4)]
+        results = [None] * 4
+
+        def run_client(i):
+            results[i] = server.client(i).predict(boards[i])
+
+        server.start()
+        try:
+            threads = [threading.Thread(target=run_client, args=(i,)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            pis, vs = server.client(0).predict_batch(np.stack(boards))
+            valid_moves = game.get_valid_moves(boards[0])
+            masked_pi, _ = server.client(1).predict(boards[0], valid_moves)
+        finally:
+            server.stop()
+
+        for i, (pi, v) in enumerate(results):
+            expected_pi, expected_v = model.predict(boards[i])
+            np.testing.assert_allclose(pi, expected_pi, rtol=1e-5, atol=1e-7)
+            np.testing.assert_allclose(v, expected_v, rtol=1e-5)
+        self.assertEqual(pis.shape, (4, game.action_size))
+        np.testing.assert_allclose(masked_pi, model.predict(boards[0], valid_moves)[0], rtol=1e-5, atol=1e-7)
+
+        stats = server.stats()
+        self.assertEqual(stats['requests'], 6)
+        self.assertEqual(sum(size * count for size, count in stats['batch_size_histogram'].items()), 9)
+        self.assertLess(stats['batches'], 6)
+        self.assertGreaterEqual(stats['latency_ms']['p99'], stats['latency_ms']['p50'])
+
+    def test_model_errors_reach_clients(self):
+        import multiprocessing
+
+        class FailingModel:
+            action_size = 4
+
+            def predict_batch(self, boards, valid_moves=None):
+                raise ValueError("bad batch")
+
+        server = InferenceServer(FailingModel(), num_clients=1, context=multiprocessing.get_context('spawn'))
+        server.start()
+        try:
+            with self.assertRaisesRegex(RuntimeError, "bad batch"):
+                server.client(0).predict(np.zeros(4))
+            # One failed batch does not take the server down
+            self.assertTrue(server.thread.is_alive())
+            with self.assertRaisesRegex(RuntimeError, "bad batch"):
+                server.client(0).predict(np.zeros(4))
+        finally:
+            server.stop()
+
+    def test_client_gives_up_on_stopped_server(self):
+        import multiprocessing
+
+        server = InferenceServer(UniformModel(4), num_clients=1, context=multiprocessing.get_context('spawn'))
+        server.start()
+        server.stop()
+        with self.assertRaisesRegex(RuntimeError, "stopped"):
+            server.client(0).predict(np.zeros(4))
+
+
+class EvaluationCacheTests(unittest.TestCase):
+
+    def test_cache_hits_evicts_and_invalidates(self):
+        game = AppleGame()
+        model = UniformModel(game.action_size)
+        cache = EvaluationCache(model, capacity=2)
+        boards = [np.full((game.ROWS, game.COLS), i) for i in range(3)]
+
+        cache.predict(boards[0])
+        cache.predict(boards[1])
+        pi, _ = cache.predict(boards[0].copy())
+        cache.predict(boards[2])
+
+        self.assertEqual(model.calls, 3)
+        self.assertFalse(pi.flags.writeable)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        cache.invalidate()
+        cache.predict(boards[0])
+        self.assertEqual(model.calls, 4)
+        self.assertEqual(cache.stats()['version'], 1)
+
+    def test_cached_batch_matches_model(self):
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        cache = EvaluationCache(model, capacity=10)
+        boards = np.stack([game.get_init_board() for _ in range(3)])
+
+        cache.predict(boards[1])
+        pis, vs = cache.predict_batch(boards)
+
+        expected_pis, expected_vs = model.predict_batch(boards)
+        np.testing.assert_allclose(pis, expected_pis, rtol=1e-5, atol=1e-7)
+        np.testing.assert_allclose(vs, expected_vs, rtol=1e-5)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_save_checkpoint_invalidates_cache(self):
+        import tempfile
+
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        trainer = Trainer(game, model, {'num_simulations': 2, 'eval_cache_size': 100})
+        trainer.evaluator.predict(game.get_init_board())
+
+        with tempfile.TemporaryDirectory() as folder:
+            trainer.save_checkpoint(folder, 'latest.pth')
+
+        self.assertEqual(trainer.evaluator.stats()['size'], 0)
+        self.assertEqual(trainer.evaluator.version, 1)
+
+
+class ScriptedPredictorTests(unittest.TestCase):
+
+    def test_matches_eager_model(self):
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        predictor = ScriptedPredictor.from_model(model, max_batch_size=2)
+        boards = np.stack([game.get_init_board() for _ in range(5)])
+        valid_moves = game.get_valid_moves_batch(boards)
+
+        pi, v = predictor.predict(boards[0], valid_moves[0])
+        expected_pi, expected_v = model.predict(boards[0], valid_moves[0])
+        np.testing.assert_allclose(pi, expected_pi, rtol=1e-5, atol=1e-8)
+        np.testing.assert_allclose(v, expected_v, rtol=1e-5)
+
+        # Larger batches grow the input buffers; unmasked calls cover every action
+        pis, vs = predictor.predict_batch(boards)
+        expected_pis, expected_vs = model.predict_batch(boards)
+        self.assertGreaterEqual(predictor.max_batch_size, 5)
+        np.testing.assert_allclose(pis, expected_pis, rtol=1e-5, atol=1e-8)
+        np.testing.assert_allclose(vs, expected_vs, rtol=1e-5)
+
+        pis, _ = predictor.predict_batch(boards[:3], valid_moves[:3])
+        np.testing.assert_allclose(pis, model.predict_batch(boards[:3], valid_moves[:3])[0], rtol=1e-5, atol=1e-8)
+
+    def test_save_and_load(self):
+        import os
+        import tempfile
+
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        board = game.get_init_board()
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'model.pt')
+            save(*trace_apple_game_model(model), path)
+            predictor = ScriptedPredictor.from_file(path)
+
+        np.testing.assert_allclose(predictor.predict(board)[0], model.predict(board)[0], rtol=1e-5, atol=1e-8)
+
+    def test_puzzle_net(self):
+        net = load_puzzle_net_class()()
+        predictor = ScriptedPredictor(*trace_puzzle_net(net))
+        boards = np.stack([AppleGame().get_init_board() for _ in range(2)])
+
+        pis, vs = predictor.predict_batch(boards)
+        with torch.no_grad():
+            expected_pis, expected_vs = net(torch.FloatTensor(boards.astype(np.float32)))
+        np.testing.assert_allclose(pis, expected_pis.numpy(), rtol=1e-4, atol=1e-7)
+        np.testing.assert_allclose(vs, expected_vs.numpy(), rtol=1e-4, atol=1e-6)
+
+    def test_puzzle_net_loads_without_touching_import_state(self):
+        import sys
+
+        path = list(sys.path)
+        load_puzzle_net_class()
+        self.assertEqual(sys.path, path)
+        self.assertNotIn('puzzle_net', sys.modules)
+        self.assertNotIn('helper', sys.modules)
+
+
+class QuantizationTests(unittest.TestCase):
+
+    def test_quantized_policy_stays_within_tolerance(self):
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        quantized = quantize(model)
+        boards = np.stack([game.get_init_board() for _ in range(8)])
+        valid_moves = game.get_valid_moves_batch(boards)
+
+        kl = check_policy_kl(model, quantized, boards, valid_moves, tolerance=1e-3)
+        self.assertEqual(kl.shape, (8,))
+        self.assertTrue(np.all(kl >= -1e-9))
+        self.assertIsInstance(model.action_head, torch.nn.Linear)
+
+        # Scripted quantized models stay close as well
+        check_policy_kl(model, ScriptedPredictor.from_model(quantized), boards, valid_moves, tolerance=1e-3)
+
+    def test_check_rejects_diverging_policy(self):
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        other = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        boards = np.stack([game.get_init_board() for _ in range(4)])
+
+        self.assertAlmostEqual(policy_kl(model, model, boards).max(), 0.0)
+        with self.assertRaises(ValueError):
+            check_policy_kl(model, other, boards, tolerance=1e-6)
+
+    def test_worker_model_quantizes_or_falls_back(self):
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+
+        quantized = worker_model(game, {'quantized_inference': True}, model.state_dict())
+        self.assertNotIsInstance(quantized.action_head, torch.nn.Linear)
+
+        fallback = worker_model(game, {'quantized_inference': True, 'quantization_kl_tolerance': -1},
+                                model.state_dict())
+        self.assertIsInstance(fallback.action_head, torch.nn.Linear)
+
+    def test_quantized_puzzle_net(self):
+        net = load_puzzle_net_class()()
+        boards = np.stack([AppleGame().get_init_board() for _ in range(2)])
+
+        check_policy_kl(ScriptedPredictor(*trace_puzzle_net(net)),
+                        ScriptedPredictor(*trace_puzzle_net(quantize(net))), boards, tolerance=1e-3)
+
+
+class ModelTests(unittest.TestCase):
+
+    def test_model_priors_cover_only_legal_moves(self):
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        boards = np.stack([game.get_init_board() for _ in range(3)])
+        valid_moves = game.get_valid_moves_batch(boards)
+
+        pis, vs = model.predict_batch(boards, valid_moves)
+        np.testing.assert_allclose(pis.sum(axis=1), 1, rtol=1e-5)
+        self.assertTrue(np.all(pis[valid_moves == 0] == 0))
+        self.assertEqual(vs.shape, (3, 1))
+
+        pi, v = model.predict(boards[0], valid_moves[0])
+        np.testing.assert_allclose(pi, pis[0], rtol=1e-5, atol=1e-8)
+
+        # Without a mask the priors cover every action, and log_softmax never underflows to -inf
+        log_pis, _ = model(torch.FloatTensor(boards.reshape(3, -1)))
+        self.assertTrue(torch.isfinite(log_pis).all())
+        np.testing.assert_allclose(model.predict(boards[0])[0].sum(), 1, rtol=1e-5)
+
+    def test_corner_policy_head(self):
+        for game in [AppleGame(), AppleGame(rows=4, cols=5)]:
+            model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'),
+                                   policy_head='corner', game=game)
+            dense = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+            boards = np.stack([game.get_init_board() for _ in range(3)])
+            valid_moves = game.get_valid_moves_batch(boards)
+
+            if game.action_size > 1000:
+                # On tiny boards there are fewer rectangles than corner embedding weights
+                self.assertLess(sum(p.numel() for p in model.parameters()),
+                                sum(p.numel() for p in dense.parameters()))
+            self.assertEqual(set(model.state_dict()), {'fc1.weight', 'fc1.bias', 'fc2.weight', 'fc2.bias',
+                                                       'action_head.corners.weight', 'action_head.corners.bias',
+                                                       'value_head.weight', 'value_head.bias'})
+
+            # Scoring only the legal rectangles gives the renormalized full distribution
+            pis, _ = model.predict_batch(boards, valid_moves)
+            full, _ = model.predict_batch(boards)
+            expected = full * valid_moves
+            expected /= expected.sum(axis=1, keepdims=True)
+            np.testing.assert_allclose(pis, expected, rtol=1e-4, atol=1e-8)
+
+            predictor = ScriptedPredictor.from_model(model)
+            np.testing.assert_allclose(predictor.predict(boards[1], valid_moves[1])[0], pis[1], rtol=1e-5, atol=1e-8)
+
+            root = MCTS(game, model, {'num_simulations': 8}).run(model, boards[0])
+            self.assertTrue(all(valid_moves[0][action] for action in root.children))
+
+
+class TrainerTests(unittest.TestCase):
+
+    def buffer(self):
+        return training_buffer()
+
+    def optimizer_steps(self, trainer):
+        return int(next(iter(trainer.optimizer.state.values()))['step'])
+
+    def test_train_runs_on_cpu(self):
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        trainer = Trainer(game, model, {'num_simulations': 4, 'batch_size': 8, 'epochs': 1})
+        before = [p.detach().clone() for p in model.parameters()]
+
+        trainer.train(self.buffer())
+
+        self.assertTrue(any(not torch.equal(a, b) for a, b in zip(before, model.parameters())))
+
+    def test_optimizer_state_persists_and_accumulates(self):
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        trainer = Trainer(game, model, {'num_simulations': 4, 'batch_size': 8, 'epochs': 1,
+                                        'effective_batch_size': 16})
+
+        # 40 examples make 5 batches of 8: two full accumulation steps and one partial
+        trainer.train(self.buffer())
+        self.assertEqual(self.optimizer_steps(trainer), 3)
+        trainer.train(self.buffer())
+        self.assertEqual(self.optimizer_steps(trainer), 6)
+
+    def test_partial_accumulation_group_is_not_scaled_down(self):
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        trainer = Trainer(game, model, {'num_simulations': 4, 'batch_size': 8, 'epochs': 1,
+                                        'effective_batch_size': 16, 'lr': 0.0})
+
+        class FixedBatch:
+            """Always the same batch, so every optimizer step should see the same gradient."""
+            batch = training_buffer().sample(8)
+
+            def __len__(self):
+                return 40
+
+            def sample(self, batch_size):
+                return self.batch
+
+        gradients = []
+        step = trainer.optimizer.step
+
+        def record_step():
+            gradients.append(torch.cat([p.grad.reshape(-1) for p in model.parameters() if p.grad is not None]))
+            step()
+
+        trainer.optimizer.step = record_step
+        trainer.train(FixedBatch())
+
+        # Two full groups of two batches, then one group of a single batch
+        self.assertEqual(len(gradients), 3)
+        for gradient in gradients[1:]:
+            torch.testing.assert_close(gradient, gradients[0], rtol=1e-4, atol=1e-6)
+
+    def test_bf16_train_and_checkpoint_round_trip(self):
+        import tempfile
+
+        game = AppleGame()
+        args = {'num_simulations': 4, 'batch_size': 8, 'epochs': 1, 'bf16': True}
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        trainer = Trainer(game, model, args)
+        trainer.train(self.buffer())
+
+        with tempfile.TemporaryDirectory() as folder:
+            trainer.save_checkpoint(folder, 'checkpoint.pth')
+            restored = Trainer(game, AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu')), args)
+            restored.load_checkpoint(folder, 'checkpoint.pth')
+
+        self.assertEqual(self.optimizer_steps(restored), self.optimizer_steps(trainer))
+        for a, b in zip(trainer.model.parameters(), restored.model.parameters()):
+            self.assertTrue(torch.equal(a, b))
+
+    def test_sparse_policy_loss_matches_dense_cross_entropy(self):
+        game = AppleGame()
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+        trainer = Trainer(game, model, {'num_simulations': 4})
+        valid_moves = torch.ones(2, game.action_size, dtype=torch.bool)
+        # Index 0 is the padding placeholder; making it illegal gives it a -inf log-probability
+        valid_moves[:, 0] = False
+        outputs, _ = model(torch.randn(2, game.get_board_size()), valid_moves)
+        indices = torch.LongTensor([[5, 9, 0], [100, 0, 0]])
+        probs = torch.FloatTensor([[0.5, 0.5, 0], [1.0, 0, 0]])
+
+        dense = torch.zeros(2, game.action_size)
+        dense[0, 5], dense[0, 9], dense[1, 100] = 0.5, 0.5, 1.0
+        expected = -(dense[:, 1:] * outputs[:, 1:]).sum(dim=1).mean()
+
+        loss = trainer.loss_pi((indices, probs), outputs)
+        self.assertAlmostEqual(loss.item(), expected.item(), places=5)
+        loss.backward()
+        self.assertTrue(all(torch.isfinite(p.grad).all() for p in model.parameters() if p.grad is not None))
+
+    def test_in_process_self_play_uses_inference_options(self):
+        game = AppleGame(rows=4, cols=5)
+        model = AppleGameModel(game.get_board_size(), game.action_size, torch.device('cpu'))
+
+        trainer = Trainer(game, model, {'num_simulations': 2})
+        trainer.refresh_self_play_evaluator()
+        self.assertIs(trainer.evaluator, model)
+
+        trainer = Trainer(game, model, {'num_simulations': 2, 'scripted_inference': True,
+                                        'eval_cache_size': 16})
+        trainer.refresh_self_play_evaluator()
+        self.assertIsInstance(trainer.evaluator, EvaluationCache)
+        self.assertIsInstance(trainer.evaluator.model, ScriptedPredictor)
+        self.assertGreater(len(trainer.exceute_episode()), 0)
+
+        trainer = Trainer(game, model, {'num_simulations': 2, 'quantized_inference': True,
+                                        'quantization_kl_tolerance': float('inf')})
+        trainer.refresh_self_play_evaluator()
+        self.assertIsNot(trainer.evaluator, model)
+        self.assertTrue(any('quantized' in type(module).__module__ for module in trainer.evaluator.modules()))
+        self.assertGreater(len(trainer.exceute_episode()), 0)
+
+
+class ReplayBufferTests(unittest.TestCase):
+
+    def examples(self, count, reward):
+        return [(np.full((2, 3), i % 10), np.eye(4)[i % 4], reward) for i in range(count)]
+
+    def test_keeps_last_iterations(self):
+        buffer = ReplayBuffer(capacity=100, board_shape=(2, 3), max_policy_size=2, num_iterations=2)
+
+        buffer.add_iteration(self.examples(5, reward=1))
+        buffer.add_iteration(self.examples(7, reward=2))
+        buffer.add_iteration(self.examples(3, reward=3))
+
+        self.assertEqual(len(buffer), 10)
+        boards, pi_indices, pi_probs, rewards = buffer.sample(200)
+        self.assertEqual(set(rewards), {2, 3})
+        self.assertEqual(boards.shape, (200, 2, 3))
+        self.assertEqual(pi_indices.shape, (200, 2))
+        np.testing.assert_array_equal(pi_probs.sum(axis=1), 1)
+        np.testing.assert_array_equal(pi_indices[:, 0], boards[:, 0, 0] % 4)
+
+    def test_sparse_policy_padding_and_truncation(self):
+        indices, probs = sparse_policy((np.array([7, 3]), np.array([0.75, 0.25])), 4)
+        np.testing.assert_array_equal(indices, [7, 3, 0, 0])
+        np.testing.assert_array_equal(probs, [0.75, 0.25, 0, 0])
+
+        indices, probs = sparse_policy(np.array([0.1, 0, 0.6, 0.3]), 2)
+        self.assertEqual(set(indices), {2, 3})
+        self.assertAlmostEqual(probs.sum(), 1.0, places=6)
+
+    def test_capacity_drops_oldest_examples(self):
+        buffer = ReplayBuffer(capacity=8, board_shape=(2, 3), max_policy_size=2, num_iterations=5)
+
+        buffer.add_iteration(self.examples(5, reward=1))
+        buffer.add_iteration(self.examples(6, reward=2))
+
+        self.assertEqual(len(buffer), 8)
+        self.assertEqual(list(buffer.iteration_sizes), [2, 6])
+        _, _, _, rewards = buffer.sample(500)
+        self.assertIn(1, set(rewards))
+
+        buffer.add_iteration(self.examples(20, reward=3))
+        self.assertEqual(len(buffer), 8)
+        self.assertEqual(list(buffer.iteration_sizes), [8])
+        _, _, _, rewards = buffer.sample(100)
+        self.assertEqual(set(rewards), {3})
+
+
+class BatchLoaderTests(unittest.TestCase):
+
+    def buffer(self):
+        return training_buffer()
+
+    def test_yields_cpu_tensors_matching_samples(self):
+        loader = BatchLoader(self.buffer().sample, 8, 5, torch.device('cpu'))
+
+        batches = list(loader)
+        self.assertEqual(len(batches), 5)
+        for boards, valid_moves, pi_indices, pi_probs, rewards in batches:
+            self.assertIsNone(valid_moves)
+            self.assertEqual(boards.shape, (8, 170))
+            self.assertEqual(boards.dtype, torch.float32)
+            self.assertEqual(pi_indices.dtype, torch.int64)
+            self.assertEqual(boards.device.type, 'cpu')
+            np.testing.assert_array_equal(pi_indices[:, 0].numpy(), rewards.numpy())
+            np.testing.assert_array_equal(boards[:, 0].numpy(), rewards.numpy() % 10)
+
+    def test_stops_producer_when_consumer_breaks_early(self):
+        loader = BatchLoader(self.buffer().sample, 4, 100, torch.device('cpu'), prefetch=1)
+        for _ in loader:
+            break
+        self.assertEqual(len(list(BatchLoader(self.buffer().sample, 4, 3, 'cpu'))), 3)
+
+    def test_sampling_errors_reach_consumer_without_blocking_producer(self):
+        import threading
+
+        buffer = self.buffer()
+        calls = []
+        failed = threading.Event()
+
+        def sample(batch_size):
+            calls.append(batch_size)
+            if len(calls) > 2:
+                failed.set()
+                raise ValueError("sampling failed")
+            return buffer.sample(batch_size)
+
+        with self.assertRaisesRegex(ValueError, "sampling failed"):
+            list(BatchLoader(sample, 4, 5, 'cpu', prefetch=1))
+
+        # The consumer stops while the queue is full and the producer holds the error
+        calls.clear()
+        failed.clear()
+        waited = []
+
+        def consume():
+            for _ in BatchLoader(sample, 4, 5, 'cpu', prefetch=1):
+                waited.append(failed.wait(timeout=5))
+                break
+
+        # On its own thread, so that a producer that never exits fails the test instead of hanging it
+        consumer = threading.Thread(target=consume, daemon=True)
+        consumer.start()
+        consumer.join(timeout=10)
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(waited, [True])
+
+    def test_computes_valid_moves(self):
+        game = AppleGame()
+        loader = BatchLoader(self.buffer().sample, 4, 2, 'cpu', valid_moves_fn=game.get_valid_moves_batch)
+
+        for boards, valid_moves, _, _, _ in loader:
+            self.assertEqual(valid_moves.dtype, torch.bool)
+            expected = game.get_valid_moves_batch(boards.numpy().reshape(4, game.ROWS, game.COLS).astype(np.int64))
+            np.testing.assert_array_equal(valid_moves.numpy(), expected.astype(bool))
+
+
+class ExampleStoreTests(unittest.TestCase):
+
+    def test_append_and_reopen(self):
+        import tempfile
+
+        game = AppleGame()
+        rng = np.random.default_rng(7)
+        examples = []
+        for i in range(5):
+            pi = np.zeros(game.action_size)
+            pi[rng.choice(game.action_size, size=3, replace=False)] = [0.5, 0.25, 0.25]
+            examples.append((rng.integers(0, 10, size=(game.ROWS, game.COLS)), pi, float(i)))
+
+        with tempfile.TemporaryDirectory() as path:
+            store = ExampleStore(path, (game.ROWS, game.COLS), game.action_size)
+            store.append(examples[:2])
+            store.append(examples[2:])
+
+            reopened = ExampleStore(path)
+            boards, pi_indices, pi_probs, rewards = reopened.get(np.arange(5))
+
+            self.assertEqual(len(reopened), 5)
+            for i, (board, pi, reward) in enumerate(examples):
+                np.testing.assert_array_equal(boards[i], board)
+                dense = np.zeros(game.action_size, dtype=np.float32)
+                dense[pi_indices[i]] += pi_probs[i]
+                np.testing.assert_array_equal(dense, pi.astype(np.float32))
+                self.assertEqual(rewards[i], reward)
+
+            boards, _, _, rewards = reopened.sample(16)
+            self.assertEqual(boards.shape, (16, game.ROWS, game.COLS))
+            self.assertEqual(len(reopened.tail(3)), 3)
+
+    def test_partial_append_is_discarded_on_reopen(self):
+        import os
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as path:
+            store = ExampleStore(path, (2, 2), 4)
+            store.append([(np.ones((2, 2)), np.array([0, 1.0, 0, 0]), 1.0)])
+
+            # Simulate a crash after some column data but before meta.json was updated
+            with open(os.path.join(path, 'boards.bin'), 'ab') as f:
+                f.write(b'\x01\x02')
+
+            reopened = ExampleStore(path)
+            reopened.append([(np.full((2, 2), 2), np.array([0, 0, 1.0, 0]), 2.0)])
+            boards, pi_indices, pi_probs, rewards = reopened.get([0, 1])
+
+            np.testing.assert_array_equal(boards[1], np.full((2, 2), 2))
+            np.testing.assert_array_equal(pi_indices[:, 0], [1, 2])
+            np.testing.assert_array_equal(pi_probs[:, 0], [1, 1])
+            np.testing.assert_array_equal(rewards, [1, 2])
+
+    def test_large_boards_keep_policy_indices(self):
+        import tempfile
+
+        action_size = AppleGame(rows=20, cols=34).get_action_size()
+        self.assertGreater(action_size, 65536)
+        pi_indices = np.array([3, 65535, 65536, 100000, action_size - 1])
+        pi_probs = np.full(5, 0.2)
+
+        with tempfile.TemporaryDirectory() as path:
+            store = ExampleStore(path, (20, 34), action_size)
+            store.append([(np.zeros((20, 34)), (pi_indices, pi_probs), 1.0)])
+            with self.assertRaises(ValueError):
+                store.append([(np.zeros((20, 34)), (np.array([action_size]), np.ones(1)), 1.0)])
+
+            _, indices, probs, _ = ExampleStore(path).get([0])
+            np.testing.assert_array_equal(indices[0], pi_indices)
+            np.testing.assert_allclose(probs[0], pi_probs, rtol=1e-3)
+
 
 if __name__ == '__main__':
     unittest.main()
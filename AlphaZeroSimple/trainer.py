@@ -1,13 +1,16 @@
 import os
 import numpy as np
-from random import shuffle
 
 import torch
 import torch.optim as optim
 
-from monte_carlo_tree_search import MCTS
+from monte_carlo_tree_search import MCTS, ArrayMCTS
+from self_play import SelfPlayPool, cpu_state_dict, worker_model
 from game import AppleGame
-from model import AppleGameModel
+from model import AppleGameModel, EvaluationCache
+from replay_buffer import ReplayBuffer
+from example_store import ExampleStore
+from data_loader import BatchLoader
 
 import time
 
@@ -17,30 +20,58 @@ class Trainer:
         self.game = game
         self.model = model
         self.args = args
-        self.mcts = MCTS(self.game, self.model, self.args)
+        # MCTS evaluates through this; an EvaluationCache in front of the model if enabled
+        self.evaluator = self.make_evaluator(model)
+        self.mcts_class = ArrayMCTS if args.get('array_tree', False) else MCTS
+        self.mcts = self.mcts_class(self.game, self.model, self.args)
+        # Kept across iterations so that Adam's moment estimates survive between train() calls.
+        # Self-play workers that evaluate through an InferenceClient have no parameters to train.
+        self.optimizer = None
+        if isinstance(model, torch.nn.Module):
+            self.optimizer = optim.Adam(self.model.parameters(), lr=args.get('lr', 5e-4))
+        # Created by learn(), so that self-play workers do not allocate or open them
+        self.replay_buffer = None
+        self.example_store = None
+
+    def make_evaluator(self, model):
+        cache_size = self.args.get('eval_cache_size', 0)
+        return EvaluationCache(model, cache_size) if cache_size else model
+
+    def refresh_self_play_evaluator(self):
+        """
+        Self-play in this process evaluates the same way SelfPlayPool workers do: with
+        scripted_inference or quantized_inference, through a CPU copy of the current weights
+        from worker_model. Call after the weights change.
+        """
+        if self.args.get('scripted_inference', False) or self.args.get('quantized_inference', False):
+            self.evaluator = self.make_evaluator(worker_model(self.game, self.args, cpu_state_dict(self.model)))
 
     def exceute_episode(self):
 
         train_examples = []
-        state = self.game.get_init_board()
+        state = self.game.get_init_state()
+        self.mcts = self.mcts_class(self.game, self.model, self.args)
+        root = None
 
         while True:
-            self.mcts = MCTS(self.game, self.model, self.args)
-            root = self.mcts.run(self.model, state)
+            root = self.mcts.run(self.evaluator, state, root=root)
 
-            action_probs = [0 for _ in range(self.game.get_action_size())]
-            for k, v in root.children.items():
-                action_probs[k] = v.visit_count
-
-            action_probs = action_probs / np.sum(action_probs)
-            train_examples.append((state, action_probs))
+            # Sparse policy target: only the visited actions and their visit frequencies
+            actions = np.fromiter(root.children.keys(), dtype=np.int64, count=len(root.children))
+            visit_counts = np.fromiter((child.visit_count for child in root.children.values()),
+                                       dtype=np.float32, count=len(root.children))
+            visited = visit_counts > 0
+            action_probs = (actions[visited], visit_counts[visited] / np.sum(visit_counts))
+            train_examples.append((np.asarray(state), action_probs))
 
             action = root.select_action(temperature=0)
             state = self.game.get_next_state(state, action)
+            # The chosen child already holds most of the visits for the next search
+            root = root.children[action] if self.args.get('reuse_tree', True) else None
             reward = self.game.get_score(state)
 
             if not self.game.has_legal_moves(state):
-                ret: list[list[np.ndarray, np.ndarray, int]] = []
+                ret: list[tuple[np.ndarray, tuple[np.ndarray, np.ndarray], int]] = []
                 for hist_state, hist_action_probs in train_examples:
                     # [Board, actionProbabilities, Reward]
                     ret.append((hist_state, hist_action_probs, reward))
@@ -49,6 +80,20 @@ class Trainer:
 
     def learn(self):
         total_start_time = time.time() 
+        num_workers = self.args.get('num_workers', 1)
+        self_play_pool = SelfPlayPool(self, num_workers) if num_workers > 1 else None
+        if self.replay_buffer is None:
+            # A root never has more visited children than simulations
+            self.replay_buffer = ReplayBuffer(self.args.get('replay_buffer_size', 50000),
+                                              (self.game.ROWS, self.game.COLS),
+                                              self.args['num_simulations'],
+                                              self.args.get('numItersForTrainExamplesHistory', 1))
+        store_path = self.args.get('example_store_path')
+        if store_path and self.example_store is None:
+            self.example_store = ExampleStore(store_path, (self.game.ROWS, self.game.COLS),
+                                              self.game.get_action_size())
+            # Pick up where a previous (possibly crashed) run left off
+            self.replay_buffer.add_iteration(self.example_store.tail(self.replay_buffer.capacity))
         for i in range(1, self.args['numIters'] + 1):
             iter_start_time = time.time()
             print("{}/{}".format(i, self.args['numIters']))
@@ -56,26 +101,47 @@ class Trainer:
             train_examples = []
 
             eps_start_time = time.time()
-            for eps in range(self.args['numEps']):
-                iteration_train_examples = self.exceute_episode()
+            if self_play_pool is not None:
+                episodes = self_play_pool.play(self.args['numEps'])
+            else:
+                self.refresh_self_play_evaluator()
+                episodes = (self.exceute_episode() for _ in range(self.args['numEps']))
+            for eps, iteration_train_examples in enumerate(episodes):
                 train_examples.extend(iteration_train_examples)
-                if eps % (self.args['numEps'] // 10) == 0:
+                if self.example_store is not None:
+                    self.example_store.append(iteration_train_examples)
+                if eps % max(self.args['numEps'] // 10, 1) == 0:
                     elapsed_eps_time = time.time() - eps_start_time
                     avg_eps_time = elapsed_eps_time / (eps + 1)
                     remaining_eps_time = avg_eps_time * (self.args['numEps'] - eps)
+                    search_stats = self_play_pool.search_stats if self_play_pool is not None else self.mcts.search_stats
                     print(f"  → Processing: {eps}/{self.args['numEps']} Episode finished "
-                        f"(Average {avg_eps_time:.2f}s/Episode, Estimated time left: {remaining_eps_time:.2f}s)")
-
-
-            shuffle(train_examples)
+                        f"(Average {avg_eps_time:.2f}s/Episode, Estimated time left: {remaining_eps_time:.2f}s, "
+                        f"{search_stats['leaves_per_sec']:.0f} leaves/s)")
+            if self_play_pool is not None and self_play_pool.inference_server is not None:
+                print(f"  → Inference server: {self_play_pool.inference_server.stats()}")
+            if self_play_pool is not None:
+                # The workers evaluate through their own caches; the trainer's is never used
+                cache_stats = self_play_pool.evaluation_cache_stats()
+                if cache_stats is not None:
+                    print(f"  → Evaluation cache ({cache_stats.pop('workers')} workers): {cache_stats}")
+            elif isinstance(self.evaluator, EvaluationCache):
+                print(f"  → Evaluation cache: {self.evaluator.stats()}")
+            if self_play_pool is None and self.mcts.transpositions is not None:
+                # Each episode starts a fresh tree and table, so these cover the last episode
+                print(f"  → Transposition table: {self.mcts.transpositions.stats()}")
+
+            self.replay_buffer.add_iteration(train_examples)
             
             train_start_time = time.time()
-            self.train(train_examples)
+            self.train(self.replay_buffer)
             train_duration = time.time() - train_start_time
             print(f"  → Model training completed (Consumed: {train_duration:.2f}s)")
             
             filename = self.args['checkpoint_path']
             self.save_checkpoint(folder=".", filename=filename)
+            if self_play_pool is not None:
+                self_play_pool.update_weights(self.model)
 
             iter_duration = time.time() - iter_start_time
             avg_iter_time = (time.time() - total_start_time) / i
@@ -84,58 +150,83 @@ class Trainer:
             print(f"Iteration {i}/{self.args['numIters']} Completed "
                 f"(Consumed time: {iter_duration:.2f}s, Estimated time left: {remaining_time:.2f}s)\n")
 
-    def train(self, examples):
-        optimizer = optim.Adam(self.model.parameters(), lr=5e-4)
+        if self_play_pool is not None:
+            self_play_pool.close()
+
+    def train(self, examples: ReplayBuffer):
+        batch_size = self.args['batch_size']
+        # Accumulate gradients over several batches to reach effective_batch_size examples per step
+        accumulation_steps = max(self.args.get('effective_batch_size', batch_size) // batch_size, 1)
+        device_type = self.model.device.type
+        use_bf16 = self.args.get('bf16', False)
         pi_losses = []
         v_losses = []
 
         for epoch in range(self.args['epochs']):
             self.model.train()
-
-            batch_idx = 0
-
-            while batch_idx < int(len(examples) / self.args['batch_size']):
-                sample_ids = np.random.randint(len(examples), size=self.args['batch_size'])
-                boards, pis, vs = list(zip(*[examples[i] for i in sample_ids]))
-                boards = torch.FloatTensor(np.array(boards).astype(np.float64))
-                target_pis = torch.FloatTensor(np.array(pis))
-                target_vs = torch.FloatTensor(np.array(vs).astype(np.float64))
-
-                # predict
-                boards = boards.contiguous().cuda()
-                target_pis = target_pis.contiguous().cuda()
-                target_vs = target_vs.contiguous().cuda()
-
+            self.optimizer.zero_grad()
+            epoch_start_time = time.time()
+            num_examples = 0
+
+            # Legal-move masks are computed on the loader thread, alongside the batch itself
+            loader = BatchLoader(examples.sample, batch_size, len(examples) // batch_size, self.model.device,
+                                 prefetch=self.args.get('prefetch_batches', 2),
+                                 valid_moves_fn=self.game.get_valid_moves_batch)
+            for batch_idx, (boards, valid_moves, target_indices, target_probs, target_vs) in enumerate(loader):
                 # compute output
-                out_pi, out_v = self.model(boards)
-                l_pi = self.loss_pi(target_pis, out_pi)
+                with torch.autocast(device_type=device_type, dtype=torch.bfloat16, enabled=use_bf16):
+                    out_log_pi, out_v = self.model(boards, valid_moves)
+                out_log_pi, out_v = out_log_pi.float(), out_v.float()
+                l_pi = self.loss_pi((target_indices, target_probs), out_log_pi)
                 l_v = self.loss_v(target_vs, out_v)
-                total_loss = l_pi + l_v
-
-                pi_losses.append(float(l_pi))
-                v_losses.append(float(l_v))
-
-                optimizer.zero_grad()
+                # Average over the batches of this optimizer step; the last group may be short
+                group_start = batch_idx - batch_idx % accumulation_steps
+                total_loss = (l_pi + l_v) / min(accumulation_steps, len(loader) - group_start)
                 total_loss.backward()
-                optimizer.step()
 
-                batch_idx += 1
+                pi_losses.append(l_pi.item())
+                v_losses.append(l_v.item())
+                num_examples += len(boards)
+
+                if (batch_idx + 1) % accumulation_steps == 0 or batch_idx + 1 == len(loader):
+                    self.optimizer.step()
+                    self.optimizer.zero_grad()
 
+            if num_examples == 0:
+                continue
+            epoch_duration = time.time() - epoch_start_time
             print()
+            print(f"Epoch {epoch + 1}/{self.args['epochs']}: {num_examples / epoch_duration:.0f} examples/s "
+                  f"({num_examples} examples, {accumulation_steps * batch_size} per optimizer step)")
             print("Policy Loss", np.mean(pi_losses))
             print("Value Loss", np.mean(v_losses))
             print("Examples:")
-            print(out_pi[0].detach())
-            print(target_pis[0])
+            print(out_log_pi[0].detach()[target_indices[0]].exp())
+            print(target_probs[0])
 
     def loss_pi(self, targets, outputs):
-        loss = -(targets * torch.log(outputs)).sum(dim=1)
+        """
+        Cross-entropy of policy log-probabilities against sparse targets: (indices, probabilities)
+        padded with zero probabilities.
+        """
+        indices, probs = targets
+        picked = outputs.gather(1, indices)
+        # Padding entries must not contribute, not even a -inf from an illegal placeholder index
+        picked = torch.where(probs > 0, picked, torch.zeros_like(picked))
+        loss = -(probs * picked).sum(dim=1)
         return loss.mean()
 
     def loss_v(self, targets, outputs):
         loss = torch.sum((targets-outputs.view(-1))**2)/targets.size()[0]
         return loss
 
+    def reset_evaluation_cache(self):
+        """
+        Drop cached evaluations made with weights that are no longer current.
+        """
+        if isinstance(self.evaluator, EvaluationCache):
+            self.evaluator.invalidate()
+
     def save_checkpoint(self, folder, filename):
         if not os.path.exists(folder):
             os.mkdir(folder)
@@ -143,4 +234,14 @@ class Trainer:
         filepath = os.path.join(folder, filename)
         torch.save({
             'state_dict': self.model.state_dict(),
+            'optimizer': self.optimizer.state_dict() if self.optimizer is not None else None,
         }, filepath)
+        self.reset_evaluation_cache()
+
+    def load_checkpoint(self, folder, filename):
+        filepath = os.path.join(folder, filename)
+        checkpoint = torch.load(filepath, map_location=self.model.device)
+        self.model.load_state_dict(checkpoint['state_dict'])
+        if checkpoint.get('optimizer') is not None and self.optimizer is not None:
+            self.optimizer.load_state_dict(checkpoint['optimizer'])
+        self.reset_evaluation_cache()
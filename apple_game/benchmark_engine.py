@@ -0,0 +1,52 @@
+import sys
+import time
+
+import numpy as np
+
+from engine import PuzzleEngine
+from rectangle_finder import RectangleFinder
+
+
+def play_random(engine: PuzzleEngine, rng, seconds_per_move=1.0):
+    """Drag random rectangles until time runs out, like a player clicking blindly."""
+    num_moves = int(np.ceil(engine.remaining_time() / seconds_per_move))
+    rows = rng.integers(0, engine.ROWS, size=(num_moves, 2)).tolist()
+    cols = rng.integers(0, engine.COLS, size=(num_moves, 2)).tolist()
+    for (r1, r2), (c1, c2) in zip(rows, cols):
+        engine.apply_move(r1, c1, r2, c2)
+        engine.clock.advance(seconds_per_move)
+
+
+def play_greedy(engine: PuzzleEngine, finder: RectangleFinder, seconds_per_move=1.0):
+    """Clear the first sum-10 rectangle in scan order until none is left or time runs out."""
+    while not engine.is_over():
+        rectangle = finder.find_first(engine.grid)
+        if rectangle is None:
+            return
+        engine.apply_move(*rectangle)
+        engine.clock.advance(seconds_per_move)
+
+
+def main(num_games=2000):
+    engine = PuzzleEngine(seed=0)
+    finder = RectangleFinder(engine.ROWS, engine.COLS)
+    rng = np.random.default_rng(0)
+
+    for name, play, games in [
+        ("random", lambda: play_random(engine, rng), num_games),
+        ("greedy", lambda: play_greedy(engine, finder), num_games // 4),
+    ]:
+        scores = []
+        start_time = time.perf_counter()
+        for _ in range(games):
+            engine.reset()
+            play()
+            scores.append(engine.score)
+        elapsed = time.perf_counter() - start_time
+        print(f"{name:<7} {games / elapsed:8.0f} games/s, mean score {np.mean(scores):6.1f}")
+
+    assert "pygame" not in sys.modules
+
+
+if __name__ == "__main__":
+    main()
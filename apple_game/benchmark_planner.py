@@ -0,0 +1,46 @@
+import time
+
+import numpy as np
+
+from planner import Planner
+
+
+def greedy_score(planner: Planner, grid):
+    """Score of always clearing the first sum-10 rectangle in scan order, as Helper does without a planner."""
+    score, _ = planner.finish_greedily(np.array(grid, dtype=np.int8), 0, [])
+    return score
+
+
+def replay(grid, plan):
+    """Apply plan to a copy of grid, checking every clear, and return the score."""
+    grid = np.array(grid)
+    score = 0
+    for r1, c1, r2, c2 in plan:
+        assert grid[r1:r2 + 1, c1:c2 + 1].sum() == 10
+        score += np.count_nonzero(grid[r1:r2 + 1, c1:c2 + 1])
+        grid[r1:r2 + 1, c1:c2 + 1] = 0
+    return score
+
+
+def main(num_boards=20, time_budgets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0), rows=10, cols=17):
+    boards = [np.random.default_rng(seed).integers(1, 10, size=(rows, cols)) for seed in range(num_boards)]
+    planner = Planner(rows, cols)
+
+    greedy = [greedy_score(planner, board) for board in boards]
+    print(f"{'greedy':>12} score {np.mean(greedy):6.1f} (min {min(greedy)}, max {max(greedy)})")
+
+    for time_budget in time_budgets:
+        scores = []
+        start_time = time.perf_counter()
+        for board in boards:
+            score, plan = planner.plan(board, time_budget)
+            assert replay(board, plan) == score
+            scores.append(score)
+        elapsed = (time.perf_counter() - start_time) / num_boards
+        wins = sum(score > base for score, base in zip(scores, greedy))
+        print(f"budget {time_budget:4.2f}s score {np.mean(scores):6.1f} (min {min(scores)}, max {max(scores)}) "
+              f"{elapsed:.2f}s/board, beats greedy on {wins}/{num_boards} boards")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+
+from engine import PuzzleEngine
+from puzzle_game import PuzzleGame
+from rectangle_finder import RectangleFinder
+
+
+def draw_frame_full(game: PuzzleGame, remaining_time):
+    """The frame as drawn before glyph caching: every cell, border and number, then a full flip."""
+    game.screen.fill(game.BACKGROUND)
+    for row in range(game.ROWS):
+        for col in range(game.COLS):
+            rect = game.cell_rect(row, col)
+            value = game.grid[row][col]
+            if (row, col) in game.selected_cells and value != 0:
+                pygame.draw.rect(game.screen, game.HIGHLIGHT, rect)
+            pygame.draw.rect(game.screen, game.BLACK, rect, 2)
+            if value != 0:
+                text = game.font.render(str(value), True, game.BLACK)
+                game.screen.blit(text, (rect.x + 10, rect.y + 10))
+    score_text = game.font.render(f"Score: {game.score}", True, game.BLACK)
+    time_text = game.font.render(f"Time: {remaining_time}s", True, game.BLACK)
+    game.screen.blit(score_text, (game.MARGIN, game.HEIGHT - 40))
+    game.screen.blit(time_text, (game.WIDTH - 150, game.HEIGHT - 40))
+    pygame.display.flip()
+
+
+def play(game: PuzzleGame, finder: RectangleFinder, draw, frames_per_move=30):
+    """
+    Greedy play at 30 frames per second: the selection is shown for half of each move's frames
+    and the grid is idle for the rest. Returns the per-frame draw times in seconds.
+    """
+    engine = game.engine
+    frame_times = []
+    while not engine.is_over():
+        rectangle = finder.find_first(engine.grid)
+        if rectangle is None:
+            break
+        for frame in range(frames_per_move):
+            game.selected_cells = engine.selected_cells(*rectangle) if frame < frames_per_move // 2 else []
+            start_time = time.perf_counter()
+            draw(game, int(engine.remaining_time()))
+            frame_times.append(time.perf_counter() - start_time)
+            engine.clock.advance(1 / 30)
+        engine.apply_move(*rectangle)
+    return frame_times
+
+
+def main():
+    finder = None
+    for name, draw in [
+        ("full", draw_frame_full),
+        ("dirty", PuzzleGame.draw_frame),
+    ]:
+        # Same seed and simulated clock, so both draw the same game
+        game = PuzzleGame(PuzzleEngine(seed=0))
+        finder = finder or RectangleFinder(game.ROWS, game.COLS)
+        frame_times = play(game, finder, draw)
+        frame_times.sort()
+        mean = sum(frame_times) / len(frame_times)
+        print(f"{name:<6} {len(frame_times):5d} frames, mean {mean * 1e3:6.3f} ms, "
+              f"p99 {frame_times[int(len(frame_times) * 0.99)] * 1e3:6.3f} ms")
+
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import numpy as np
+
+
+class SimulatedClock:
+    """A clock that only moves when told to, so games can run faster (or slower) than real time."""
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class PuzzleEngine:
+    """
+    The rules of the number sum puzzle without any rendering: a grid of numbers 1-9, rectangles
+    whose numbers sum to 10 are cleared for one point per number, until the time limit runs out.
+    clock is a function returning seconds; a SimulatedClock by default.
+    """
+
+    def __init__(self, rows=10, cols=17, time_limit=120, seed=None, clock=None):
+        self.ROWS, self.COLS = rows, cols
+        self.TIME_LIMIT = time_limit
+        self.clock = SimulatedClock() if clock is None else clock
+        self.rng = np.random.default_rng(seed)
+        self.reset()
+
+    def reset(self):
+        """Start a new game with a fresh grid."""
+        self.grid = self.generate_grid()
+        self.score = 0
+        self.moves = 0
+        self.start_time = self.clock()
+
+    def generate_grid(self):
+        """Generate a grid filled with random numbers from 1 to 9."""
+        return self.rng.integers(1, 10, size=(self.ROWS, self.COLS))
+
+    def elapsed_time(self):
+        return self.clock() - self.start_time
+
+    def remaining_time(self):
+        return max(self.TIME_LIMIT - self.elapsed_time(), 0)
+
+    def is_over(self):
+        return self.remaining_time() == 0
+
+    def normalize(self, r1, c1, r2, c2):
+        """Order the corners of a selection and clip it to the grid. Returns None if it misses the grid."""
+        r1, r2 = max(min(r1, r2), 0), min(max(r1, r2), self.ROWS - 1)
+        c1, c2 = max(min(c1, c2), 0), min(max(c1, c2), self.COLS - 1)
+        if r1 > r2 or c1 > c2:
+            return None
+        return r1, c1, r2, c2
+
+    def selected_cells(self, r1, c1, r2, c2):
+        """The (row, col) cells of a selection that still hold a number."""
+        rectangle = self.normalize(r1, c1, r2, c2)
+        if rectangle is None:
+            return []
+        r1, c1, r2, c2 = rectangle
+        rows, cols = np.nonzero(self.grid[r1:r2 + 1, c1:c2 + 1])
+        return list(zip((rows + r1).tolist(), (cols + c1).tolist()))
+
+    def selection_sum(self, r1, c1, r2, c2):
+        rectangle = self.normalize(r1, c1, r2, c2)
+        if rectangle is None:
+            return 0
+        r1, c1, r2, c2 = rectangle
+        return int(self.grid[r1:r2 + 1, c1:c2 + 1].sum())
+
+    def apply_move(self, r1, c1, r2, c2):
+        """
+        Clear the selection if its numbers sum to 10 and the game is not over.
+        Returns the points scored, 0 for a move that does not count.
+        """
+        if self.is_over():
+            return 0
+        rectangle = self.normalize(r1, c1, r2, c2)
+        if rectangle is None:
+            return 0
+        r1, c1, r2, c2 = rectangle
+        cells = self.grid[r1:r2 + 1, c1:c2 + 1]
+        if cells.sum() != 10:
+            return 0
+        points = int(np.count_nonzero(cells))
+        cells[...] = 0
+        self.score += points
+        self.moves += 1
+        return points
@@ -0,0 +1,36 @@
+import queue
+import threading
+from collections import deque, namedtuple
+
+
+# Clear the rectangle from (r1, c1) to (r2, c2), as if it had been dragged with the mouse
+MoveCommand = namedtuple("MoveCommand", ["r1", "c1", "r2", "c2"])
+
+
+class EventChannel:
+    """
+    Bounded input queue for the game loop. Any thread may put pygame events or commands such as
+    MoveCommand; the game loop takes everything queued with one drain() per frame.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.items = deque()
+        self.not_full = threading.Condition()
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item, timeout=None):
+        """Queue item, waiting up to timeout seconds for room. Raises queue.Full if none frees up."""
+        with self.not_full:
+            if not self.not_full.wait_for(lambda: len(self.items) < self.maxsize, timeout):
+                raise queue.Full
+            self.items.append(item)
+
+    def drain(self):
+        """Everything queued so far, in order, leaving the channel empty."""
+        with self.not_full:
+            items, self.items = self.items, deque()
+            self.not_full.notify_all()
+        return list(items)
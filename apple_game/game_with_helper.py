@@ -1,6 +1,7 @@
 import pygame
 from puzzle_game import PuzzleGame
 from helper import Helper
+from planner import Planner
 import threading
 
 
@@ -13,5 +14,5 @@ game_thread.start()
 
 pygame.time.delay(1000) 
 
-helper = Helper(game)
+helper = Helper(game, Planner(game.ROWS, game.COLS))
 helper.run()
@@ -1,11 +1,14 @@
 from puzzle_game import PuzzleGame
-import pygame
-import time
+from rectangle_finder import RectangleFinder
+from planner import Planner
+import numpy as np
 
 
 class Helper:
-    def __init__(self, puzzle_game: PuzzleGame):
+    def __init__(self, puzzle_game: PuzzleGame, planner: Planner = None):
         self.puzzle_game = puzzle_game
+        self.planner = planner
+        self.plan = []
 
         self.COLS = self.puzzle_game.COLS
         self.ROWS = self.puzzle_game.ROWS
@@ -14,121 +17,54 @@ class Helper:
         self.y_start = 0
         self.x_end = 0
         self.y_end = 0
+        self.finder = RectangleFinder(self.ROWS, self.COLS)
 
     def convert_2d_to_1d(self, x, y):
         return x + self.COLS*y
         
     def run(self):
+        version = None
         while self.puzzle_game.running:
-            if self.check_valid_rectangle():
+            with self.puzzle_game.grid_changed:
+                changed = self.puzzle_game.grid_version != version
+                if changed:
+                    version = self.puzzle_game.grid_version
+                    grid = np.array(self.puzzle_game.grid)
+            # Search on a snapshot, so that planning never holds up the game loop
+            if changed:
+                found = self.check_valid_rectangle(grid)
+            if found:
                 self.generate_event()
-                        
+            # Sleep until the move lands (or the game ends); resend it if it got lost
+            self.puzzle_game.wait_for_grid_change(version, timeout=1.0 if found else None)
 
-    def check_valid_rectangle(self):
-        for j in range(1, self.COLS):
-            index = self.x_start + self.COLS*self.y_start
-            for i in range(self.GRID_NUM):
-                y,x = divmod((index+i)%self.GRID_NUM, self.COLS)                
-                if self.check_right(x, y, j):
-                    return True
-                
-                if self.check_up(x, y, j):
-                    return True
-                
-                if self.check_left(x, y, j):
-                    return True
-                
-                if self.check_down(x, y, j):
-                    return True
-        return False
-            
-    def generate_event(self):
-        self.puzzle_game.add_event(
-            pygame.event.Event(pygame.MOUSEBUTTONDOWN, {
-                "pos": [
-                    self.puzzle_game.grid_x + self.x_start * self.puzzle_game.cell_size, 
-                    self.puzzle_game.grid_y + self.y_start * self.puzzle_game.cell_size,
-                ], 
-                "button": 1,
-            })
-        )
-        self.puzzle_game.add_event(
-            pygame.event.Event(pygame.MOUSEMOTION, {
-                "pos": [
-                    self.puzzle_game.grid_x + self.x_end * self.puzzle_game.cell_size, 
-                    self.puzzle_game.grid_y + self.y_end * self.puzzle_game.cell_size,
-                ],
-            })
-        )
-        time.sleep(0.1)
-        self.puzzle_game.add_event(
-            pygame.event.Event(pygame.MOUSEBUTTONUP, {
-                "pos": [
-                    self.puzzle_game.grid_x + self.x_end * self.puzzle_game.cell_size, 
-                    self.puzzle_game.grid_y + self.y_end * self.puzzle_game.cell_size,
-                ],
-                "button": 1,
-            })
-        )
-        time.sleep(0.1)
-
-    
-    def check_right(self, x, y, length):
-        if y + length >= self.ROWS: return False
-        value_sum = 0
-        for i in range(self.COLS):
-            if x+i >= self.COLS: return False
-            for j in range(length):
-                value_sum = value_sum + self.puzzle_game.grid[y+j][x+i]
-            if value_sum == 10:
-                self.update_range(x,y,i,length-1)
-                return True
-            elif value_sum < 10: continue
-            else: return False
-    
-    
-    def check_up(self, x, y, length):
-        if x + length >= self.COLS: return False
-        value_sum = 0
-        for i in range(self.ROWS):
-            if y-i < 0: return False
-            for j in range(length):
-                value_sum = value_sum + self.puzzle_game.grid[y-i][x+j]
-            if value_sum == 10:
-                self.update_range(x,y,length-1,-i)
-                return True
-            elif value_sum < 10: continue
-            else: return False
+    def check_valid_rectangle(self, grid=None):
+        """
+        Store the corners of the next rectangle to clear: the next step of the planner's plan,
+        or without a planner the first sum-10 rectangle found in one prefix-sum pass.
+        """
+        grid = np.asarray(self.puzzle_game.grid if grid is None else grid)
+        if self.planner is None:
+            rectangle = self.finder.find_first(grid)
+        else:
+            # Replan when the plan is used up or the board has moved away from it
+            if not self.plan or not self.is_valid(grid, self.plan[0]):
+                _, self.plan = self.planner.plan(grid)
+            rectangle = self.plan.pop(0) if self.plan else None
+        if rectangle is None:
+            return False
+        r1, c1, r2, c2 = rectangle
+        self.update_range(c1, r1, c2 - c1, r2 - r1)
+        return True
 
-    
-    def check_left(self, x, y, length):
-        if y - length < 0: return False
-        value_sum = 0
-        for i in range(self.COLS):
-            if x-i < 0: return False
-            for j in range(length):
-                value_sum = value_sum + self.puzzle_game.grid[y-j][x-i]
-            if value_sum == 10:
-                self.update_range(x,y,-i, -(length-1))
-                return True
-            elif value_sum < 10: continue
-            else: return False
-    
-    
-    def check_down(self, x, y, length):
-        if x - length < 0: return False
-        value_sum = 0
-        for i in range(self.ROWS):
-            if y+i >= self.ROWS: return False
-            for j in range(length):
-                value_sum = value_sum + self.puzzle_game.grid[y+i][x-j]
-            if value_sum == 10:
-                self.update_range(x,y,-(length-1), i)
-                return True
-            elif value_sum < 10: continue
-            else: return False
+    def is_valid(self, grid, rectangle):
+        r1, c1, r2, c2 = rectangle
+        return grid[r1:r2 + 1, c1:c2 + 1].sum() == 10
 
+    def generate_event(self):
+        self.puzzle_game.apply_move(self.y_start, self.x_start, self.y_end, self.x_end)
 
+    
     def update_range(self, x, y, dx, dy):
         self.x_start = x
         self.x_end = x+dx
@@ -0,0 +1,80 @@
+import time
+
+import numpy as np
+
+from rectangle_finder import RectangleFinder
+
+
+class Planner:
+    """
+    Plans a whole sequence of clears with a beam search over boards, within a time budget.
+    Boards on the beam are ranked by score plus mobility_weight times the number of clears
+    left on them, so that moves which keep other moves open win over moves that only score now.
+    """
+
+    def __init__(self, rows, cols, beam_width=4, time_budget=1.0, mobility_weight=5):
+        self.finder = RectangleFinder(rows, cols)
+        self.beam_width = beam_width
+        self.time_budget = time_budget
+        self.mobility_weight = mobility_weight
+
+    def expand(self, grid, score, plan, seen):
+        """Ranked children of a beam entry, skipping boards some other move order already reached."""
+        matches = self.finder.rectangle_sums(grid) == self.finder.target
+        rectangles = self.finder.rectangles[matches]
+        if len(rectangles) == 0:
+            return []
+        gains = self.finder.rectangle_counts(grid)[matches]
+        children = self.finder.clear(grid, rectangles)
+
+        # The score follows from the board, so a board seen before is never worth revisiting
+        keys = [child.tobytes() for child in children]
+        new = [i for i, key in enumerate(keys) if key not in seen]
+        seen.update(keys)
+        if not new:
+            return []
+        mobility = np.count_nonzero(self.finder.rectangle_sums(children[new]) == self.finder.target, axis=1)
+
+        return [
+            (score + gain + self.mobility_weight * moves, children[i], score + gain, plan + [tuple(rectangles[i].tolist())])
+            for i, gain, moves in zip(new, gains[new].tolist(), mobility.tolist())
+        ]
+
+    def finish_greedily(self, grid, score, plan):
+        """Extend plan by clearing the first rectangle found until no move is left."""
+        grid = grid.copy()
+        plan = list(plan)
+        while True:
+            rectangle = self.finder.find_first(grid)
+            if rectangle is None:
+                return score, plan
+            r1, c1, r2, c2 = rectangle
+            score += int(np.count_nonzero(grid[r1:r2 + 1, c1:c2 + 1]))
+            grid[r1:r2 + 1, c1:c2 + 1] = 0
+            plan.append(rectangle)
+
+    def plan(self, grid, time_budget=None):
+        """
+        A full sequence of (r1, c1, r2, c2) clears for grid and the score it earns. The beam
+        search runs until no moves are left or time_budget seconds pass; the best board on the
+        last beam is then finished greedily. The plain greedy plan wins if it scores higher.
+        """
+        deadline = time.perf_counter() + (self.time_budget if time_budget is None else time_budget)
+        grid = np.array(grid, dtype=np.int8)
+        beam = [(grid, 0, [])]
+        best = beam[0]
+        seen = {grid.tobytes()}
+
+        while beam and time.perf_counter() < deadline:
+            children = []
+            for entry in beam:
+                children.extend(self.expand(*entry, seen))
+                if time.perf_counter() >= deadline:
+                    break
+            children.sort(key=lambda child: child[0], reverse=True)
+            beam = [child[1:] for child in children[:self.beam_width]]
+            if beam:
+                best = beam[0]
+
+        # The plain greedy plan costs a few milliseconds and is a floor for short budgets
+        return max(self.finish_greedily(*best), self.finish_greedily(grid, 0, []), key=lambda result: result[0])
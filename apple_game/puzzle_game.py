@@ -1,16 +1,28 @@
+import numpy as np
 import pygame
-import random
+import threading
+
+# Relative when imported as the apple_game package, flat when the scripts here are run directly
+try:
+    from .engine import PuzzleEngine
+    from .event_channel import EventChannel, MoveCommand
+except ImportError:
+    from engine import PuzzleEngine
+    from event_channel import EventChannel, MoveCommand
 
 class PuzzleGame:
-    def __init__(self):
+    """A pygame view of a PuzzleEngine, which holds the grid, score and clock."""
+
+    def __init__(self, engine: PuzzleEngine = None):
         # Game settings
         self.WIDTH, self.HEIGHT = 800, 500  # Window size
-        self.ROWS, self.COLS = 10, 17  # Grid size
         self.MARGIN = 50  # Margin around the grid
-        self.TIME_LIMIT = 120  # Time limit in seconds (2 minutes)
-        self.cell_size = min((self.WIDTH - 2 * self.MARGIN) // self.COLS, (self.HEIGHT - 2 * self.MARGIN) // self.ROWS)
-        self.grid_x = (self.WIDTH - (self.cell_size * self.COLS)) // 2
-        self.grid_y = (self.HEIGHT - (self.cell_size * self.ROWS)) // 2
+        # Rules, grid and score, timed by the pygame clock unless an engine is given. A given
+        # engine is shown as it is, so a prepared or replayed game keeps its grid and score
+        self.engine = engine
+        if engine is None:
+            self.engine = PuzzleEngine(10, 17, time_limit=120, clock=lambda: pygame.time.get_ticks() / 1000)
+        self.ROWS, self.COLS = self.engine.ROWS, self.engine.COLS  # Grid size
 
         # Colors
         self.WHITE = (255, 255, 255)
@@ -25,33 +37,115 @@ class PuzzleGame:
         pygame.display.set_caption("Number Sum Puzzle")
         self.font = pygame.font.Font(None, 36)
         self.clock = pygame.time.Clock()
+        # Numbers never change their look, so each is rendered once
+        self.glyphs = {n: self.font.render(str(n), True, self.BLACK) for n in range(1, 10)}
+        self.layout()
 
-        # Generate grid
-        self.grid = self.generate_grid()
+        if engine is None:
+            # Start the clock once pygame is up
+            self.engine.reset()
         self.start_pos = None
         self.selected_cells = []
-        self.score = 0
-        self.start_time = pygame.time.get_ticks()
 
-        self.events = []
+        # Notified whenever numbers are cleared (grid_version changes) and at game over
+        self.grid_changed = threading.Condition()
 
-    def generate_grid(self):
-        """Generate a grid filled with random numbers from 1 to 9."""
-        return [[random.randint(1, 9) for _ in range(self.COLS)] for _ in range(self.ROWS)]
+        # Input from other threads (pygame events and MoveCommands), taken once per frame
+        self.events = EventChannel()
 
-    def draw_grid(self):
-        """Draw the grid and highlight selected cells."""
-        self.screen.fill(self.BACKGROUND)
+    @property
+    def grid(self):
+        return self.engine.grid
+
+    @property
+    def score(self):
+        return self.engine.score
+
+    @property
+    def TIME_LIMIT(self):
+        return self.engine.TIME_LIMIT
+
+    @TIME_LIMIT.setter
+    def TIME_LIMIT(self, seconds):
+        self.engine.TIME_LIMIT = seconds
+
+    @property
+    def grid_version(self):
+        """Bumped by every clear."""
+        return self.engine.moves
+
+    def layout(self):
+        """Fit the grid to the window and rebuild the cached background; the next frame is drawn in full."""
+        self.cell_size = min((self.WIDTH - 2 * self.MARGIN) // self.COLS, (self.HEIGHT - 2 * self.MARGIN) // self.ROWS)
+        self.grid_x = (self.WIDTH - (self.cell_size * self.COLS)) // 2
+        self.grid_y = (self.HEIGHT - (self.cell_size * self.ROWS)) // 2
+        self.background = self.draw_background()
+        self.full_redraw = True
 
+    def cell_rect(self, row, col):
+        return pygame.Rect(self.grid_x + col * self.cell_size, self.grid_y + row * self.cell_size, self.cell_size, self.cell_size)
+
+    def draw_background(self):
+        """The parts of the screen that never change: the background color and the cell borders."""
+        background = pygame.Surface((self.WIDTH, self.HEIGHT))
+        background.fill(self.BACKGROUND)
         for row in range(self.ROWS):
             for col in range(self.COLS):
-                rect = pygame.Rect(self.grid_x + col * self.cell_size, self.grid_y + row * self.cell_size, self.cell_size, self.cell_size)
-                if (row, col) in self.selected_cells and self.grid[row][col] != 0:
-                    pygame.draw.rect(self.screen, self.HIGHLIGHT, rect)
+                pygame.draw.rect(background, self.BLACK, self.cell_rect(row, col), 2)
+        return background
+
+    def draw_grid(self):
+        """Redraw the cells whose number or selection changed since the last call. Returns the rects drawn."""
+        selected = np.zeros((self.ROWS, self.COLS), dtype=bool)
+        for row, col in self.selected_cells:
+            selected[row, col] = True
+        # What each cell shows: its number, plus 10 while it is highlighted
+        shown = np.where(selected & (self.grid != 0), self.grid + 10, self.grid)
+
+        dirty_rects = []
+        for row, col in np.argwhere(shown != self.shown).tolist():
+            rect = self.cell_rect(row, col)
+            self.screen.blit(self.background, rect, rect)
+            value = self.grid[row][col]
+            if value != 0 and selected[row, col]:
+                pygame.draw.rect(self.screen, self.HIGHLIGHT, rect)
                 pygame.draw.rect(self.screen, self.BLACK, rect, 2)
-                if self.grid[row][col] != 0:
-                    text = self.font.render(str(self.grid[row][col]), True, self.BLACK)
-                    self.screen.blit(text, (self.grid_x + col * self.cell_size + 10, self.grid_y + row * self.cell_size + 10))
+            if value != 0:
+                self.screen.blit(self.glyphs[value], (rect.x + 10, rect.y + 10))
+            dirty_rects.append(rect)
+        self.shown = shown
+        return dirty_rects
+
+    def draw_status(self, remaining_time):
+        """Redraw the score and remaining time if either changed. Returns the rects drawn."""
+        status = (self.score, remaining_time)
+        if status == self.status:
+            return []
+        self.status = status
+
+        rect = pygame.Rect(0, self.HEIGHT - 40, self.WIDTH, 40)
+        self.screen.blit(self.background, rect, rect)
+        score_text = self.font.render(f"Score: {self.score}", True, self.BLACK)
+        time_text = self.font.render(f"Time: {remaining_time}s", True, self.BLACK)
+        self.screen.blit(score_text, (self.MARGIN, self.HEIGHT - 40))
+        self.screen.blit(time_text, (self.WIDTH - 150, self.HEIGHT - 40))
+        return [rect]
+
+    def draw_frame(self, remaining_time):
+        """Draw what changed since the last frame and push only those parts to the display."""
+        if self.full_redraw:
+            self.screen.blit(self.background, (0, 0))
+            self.shown = np.full((self.ROWS, self.COLS), -1)
+            self.status = None
+
+        dirty_rects = self.draw_grid() + self.draw_status(remaining_time)
+
+        if self.full_redraw:
+            pygame.display.flip()
+            self.full_redraw = False
+        elif dirty_rects:
+            pygame.display.update(dirty_rects)
+        return dirty_rects
 
     def draw_game_over(self):
         """Displays the game over message in the center of the screen."""
@@ -71,67 +165,66 @@ class PuzzleGame:
             self.clock.tick(30)
 
     
-    def get_selected_cells(self, start, end, grid_x, grid_y, cell_size):
-        """Determine the selected cells within the drawn rectangle."""
-        x1, y1 = min(start[0], end[0]), min(start[1], end[1])
-        x2, y2 = max(start[0], end[0]), max(start[1], end[1])
-        return [(r, c) for r in range(y1, y2+1) for c in range(x1, x2+1)]
-
     def run(self):
         """Main game loop."""
         self.running = True
         while self.running:
-            elapsed_time = (pygame.time.get_ticks() - self.start_time) // 1000
-            remaining_time = max(self.TIME_LIMIT - elapsed_time, 0)
-            if remaining_time == 0:
-                self.running = False
-
-            self.screen.fill(self.BACKGROUND)
-            cell_size = min((self.WIDTH - 2 * self.MARGIN) // self.COLS, (self.HEIGHT - 2 * self.MARGIN) // self.ROWS)
-            grid_x = (self.WIDTH - (cell_size * self.COLS)) // 2
-            grid_y = (self.HEIGHT - (cell_size * self.ROWS)) // 2
-            self.draw_grid()
-
-            # Display score and remaining time
-            score_text = self.font.render(f"Score: {self.score}", True, self.BLACK)
-            time_text = self.font.render(f"Time: {remaining_time}s", True, self.BLACK)
-            self.screen.blit(score_text, (self.MARGIN, self.HEIGHT - 40))
-            self.screen.blit(time_text, (self.WIDTH - 150, self.HEIGHT - 40))
-
-            pygame.display.flip()
-            
-            for event in pygame.event.get() + self.events:
-                if event.type == pygame.QUIT:
-                    self.running = False
+            remaining_time = int(self.engine.remaining_time())
+            if self.engine.is_over():
+                self.stop()
+
+            self.draw_frame(remaining_time)
+            cell_size, grid_x, grid_y = self.cell_size, self.grid_x, self.grid_y
+
+            for event in pygame.event.get() + self.events.drain():
+                if isinstance(event, MoveCommand):
+                    self.commit_move(*event)
+                elif event.type == pygame.QUIT:
+                    self.stop()
                     pygame.quit()
                     return
                 elif event.type == pygame.VIDEORESIZE:
                     self.WIDTH, self.HEIGHT = event.w, event.h
+                    self.layout()
                 elif event.type == pygame.MOUSEBUTTONDOWN:
                     self.start_pos = ((event.pos[0] - grid_x) // cell_size, (event.pos[1] - grid_y) // cell_size)
                 elif event.type == pygame.MOUSEMOTION and self.start_pos:
                     end_pos = ((event.pos[0] - grid_x) // cell_size, (event.pos[1] - grid_y) // cell_size)
-                    self.selected_cells = [(r, c) for r, c in self.get_selected_cells(self.start_pos, end_pos, grid_x, grid_y, cell_size) if 0 <= r < self.ROWS and 0 <= c < self.COLS and self.grid[r][c] != 0]
+                    self.selected_cells = self.engine.selected_cells(self.start_pos[1], self.start_pos[0], end_pos[1], end_pos[0])
                 elif event.type == pygame.MOUSEBUTTONUP and self.start_pos:
                     end_pos = ((event.pos[0] - grid_x) // cell_size, (event.pos[1] - grid_y) // cell_size)
-                    self.selected_cells = [(r, c) for r, c in self.get_selected_cells(self.start_pos, end_pos, grid_x, grid_y, cell_size) if 0 <= r < self.ROWS and 0 <= c < self.COLS and self.grid[r][c] != 0]
-                    
-                    # Calculate the sum of selected numbers
-                    total = sum(self.grid[r][c] for r, c in self.selected_cells if self.grid[r][c] != 0)
-                    if total == 10:
-                        self.score += len(self.selected_cells)
-                        for r, c in self.selected_cells:
-                            self.grid[r][c] = 0  # Remove numbers
-                    
+                    self.commit_move(self.start_pos[1], self.start_pos[0], end_pos[1], end_pos[0])
+
                     self.selected_cells = []
                     self.start_pos = None
-                
-                self.events.clear()
-            
+
             self.clock.tick(30)
 
         self.draw_game_over()
         print(f"Game Over! Your final score: {self.score}")
 
+    def commit_move(self, r1, c1, r2, c2):
+        """Clear a selection on the game thread and wake anyone waiting for the grid to change."""
+        with self.grid_changed:
+            if self.engine.apply_move(r1, c1, r2, c2):
+                self.grid_changed.notify_all()
+
+    def stop(self):
+        """End the game loop and wake up anyone waiting for the grid to change."""
+        with self.grid_changed:
+            self.running = False
+            self.grid_changed.notify_all()
+
+    def wait_for_grid_change(self, version, timeout=None):
+        """Block until grid_version differs from version or the game ends. Returns the current grid_version."""
+        with self.grid_changed:
+            self.grid_changed.wait_for(lambda: self.grid_version != version or not self.running, timeout)
+            return self.grid_version
+
     def add_event(self, event):
-        self.events.append(event)
\ No newline at end of file
+        """Queue a pygame event for the next frame. Safe to call from any thread."""
+        self.events.put(event)
+
+    def apply_move(self, r1, c1, r2, c2):
+        """Queue a clear of the rectangle (r1, c1)-(r2, c2) for the next frame. Safe to call from any thread."""
+        self.events.put(MoveCommand(r1, c1, r2, c2))
\ No newline at end of file
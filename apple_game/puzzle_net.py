@@ -37,4 +37,5 @@ def test_model():
     print("Policy Output Shape:", policy.shape)  # Should match (1, num_actions)
     print("Value Output Shape:", value.shape)  # Should be (1, 1)
 
-test_model()
+if __name__ == "__main__":
+    test_model()
@@ -0,0 +1,58 @@
+import numpy as np
+
+
+class RectangleFinder:
+    """Finds every rectangle of a grid whose numbers sum to a target, using a 2D prefix sum."""
+
+    def __init__(self, rows, cols, target=10):
+        self.ROWS, self.COLS = rows, cols
+        self.target = target
+
+        # Corners of every rectangle, top-left (r1, c1) to bottom-right (r2, c2), in scan order
+        r1, c1, r2, c2 = np.meshgrid(np.arange(rows), np.arange(cols), np.arange(rows), np.arange(cols), indexing="ij")
+        keep = (r2 >= r1) & (c2 >= c1)
+        self.rectangles = np.stack([r1[keep], c1[keep], r2[keep], c2[keep]], axis=1)
+        r1, c1, r2, c2 = self.rectangles.T
+
+        # Flat indices of the four corners in the (ROWS+1, COLS+1) prefix sum table
+        stride = cols + 1
+        self.top_left = r1 * stride + c1
+        self.top_right = r1 * stride + c2 + 1
+        self.bottom_left = (r2 + 1) * stride + c1
+        self.bottom_right = (r2 + 1) * stride + c2 + 1
+
+    def prefix_sum(self, grid):
+        """Integral image of the grid, padded with a leading row and column of zeros. Leading axes are a batch of grids."""
+        grid = np.asarray(grid)
+        prefix_sum = np.zeros(grid.shape[:-2] + (self.ROWS + 1, self.COLS + 1), dtype=np.int32)
+        np.cumsum(np.cumsum(grid, axis=-2), axis=-1, out=prefix_sum[..., 1:, 1:])
+        return prefix_sum
+
+    def rectangle_sums(self, grid):
+        """Sum of every rectangle, in the order of self.rectangles, for one grid or a batch of grids."""
+        prefix_sum = self.prefix_sum(grid)
+        # Gathering along the first axis copies whole rows of the batch at once
+        flat = np.ascontiguousarray(np.moveaxis(prefix_sum.reshape(prefix_sum.shape[:-2] + (-1,)), -1, 0))
+        sums = flat[self.bottom_right] - flat[self.top_right] - flat[self.bottom_left] + flat[self.top_left]
+        return np.moveaxis(sums, 0, -1)
+
+    def rectangle_counts(self, grid):
+        """Number of nonzero cells in every rectangle, in the order of self.rectangles."""
+        return self.rectangle_sums(np.asarray(grid) != 0)
+
+    def clear(self, grid, rectangles):
+        """One copy of grid per (r1, c1, r2, c2) rectangle, with that rectangle set to zero."""
+        r1, c1, r2, c2 = np.asarray(rectangles).reshape(-1, 4).T[:, :, None, None]
+        rows = np.arange(self.ROWS)[:, None]
+        cols = np.arange(self.COLS)
+        inside = (rows >= r1) & (rows <= r2) & (cols >= c1) & (cols <= c2)
+        return np.where(inside, 0, np.asarray(grid)[None])
+
+    def find_all(self, grid):
+        """All (r1, c1, r2, c2) rectangles summing to the target, in row-major order of their top-left corner."""
+        return [tuple(rect) for rect in self.rectangles[self.rectangle_sums(grid) == self.target].tolist()]
+
+    def find_first(self, grid):
+        """The first rectangle summing to the target, or None."""
+        matches = np.flatnonzero(self.rectangle_sums(grid) == self.target)
+        return tuple(self.rectangles[matches[0]].tolist()) if len(matches) else None
@@ -0,0 +1,370 @@
+import importlib
+import os
+import queue
+import sys
+import threading
+import time
+import unittest
+
+# Pygame windows open on a display that draws nowhere
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pygame
+
+from engine import PuzzleEngine, SimulatedClock
+from event_channel import EventChannel, MoveCommand
+from helper import Helper
+from planner import Planner
+from puzzle_game import PuzzleGame
+from rectangle_finder import RectangleFinder
+
+
+class PackageTests(unittest.TestCase):
+
+    def test_import_package(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        if root not in sys.path:
+            sys.path.insert(0, root)
+        apple_game = importlib.import_module("apple_game")
+        self.assertEqual(apple_game.PuzzleGame.__name__, "PuzzleGame")
+
+
+class PuzzleEngineTests(unittest.TestCase):
+
+    def make_engine(self, grid, time_limit=120):
+        engine = PuzzleEngine(*np.shape(grid), time_limit=time_limit, seed=0)
+        engine.grid = np.array(grid)
+        return engine
+
+    def test_normalize_orders_and_clips_corners(self):
+        engine = PuzzleEngine(3, 4)
+        self.assertEqual(engine.normalize(2, 3, 0, 1), (0, 1, 2, 3))
+        self.assertEqual(engine.normalize(-1, -2, 5, 9), (0, 0, 2, 3))
+        self.assertEqual(engine.normalize(1, 1, 1, 1), (1, 1, 1, 1))
+        self.assertIsNone(engine.normalize(3, 0, 4, 1))
+        self.assertIsNone(engine.normalize(0, -3, 2, -1))
+
+    def test_apply_move_scores_nonzero_cells(self):
+        engine = self.make_engine([[1, 0, 9],
+                                   [5, 5, 2]])
+        # 1 + 9 with a cleared cell between them is worth 2 points, not 3
+        self.assertEqual(engine.apply_move(0, 0, 0, 2), 2)
+        self.assertEqual(engine.score, 2)
+        self.assertEqual(engine.moves, 1)
+        np.testing.assert_array_equal(engine.grid, [[0, 0, 0], [5, 5, 2]])
+        # Corners in any order
+        self.assertEqual(engine.apply_move(1, 1, 1, 0), 2)
+        self.assertEqual(engine.score, 4)
+        self.assertEqual(engine.moves, 2)
+
+    def test_apply_move_rejects_wrong_sums(self):
+        engine = self.make_engine([[1, 2, 3],
+                                   [4, 5, 6]])
+        grid = engine.grid.copy()
+        self.assertEqual(engine.apply_move(0, 0, 0, 2), 0)
+        self.assertEqual(engine.apply_move(0, 0, 1, 2), 0)
+        self.assertEqual(engine.apply_move(5, 5, 6, 6), 0)
+        np.testing.assert_array_equal(engine.grid, grid)
+        self.assertEqual((engine.score, engine.moves), (0, 0))
+
+    def test_selection_clips_to_grid(self):
+        engine = self.make_engine([[1, 9, 0],
+                                   [3, 3, 3]])
+        self.assertEqual(engine.selection_sum(-1, -1, 0, 5), 10)
+        self.assertEqual(engine.selected_cells(-1, -1, 0, 5), [(0, 0), (0, 1)])
+        self.assertEqual(engine.apply_move(-1, -1, 0, 5), 2)
+
+    def test_is_over_with_simulated_clock(self):
+        engine = self.make_engine([[4, 6]], time_limit=10)
+        self.assertIsInstance(engine.clock, SimulatedClock)
+        self.assertFalse(engine.is_over())
+        engine.clock.advance(9.5)
+        self.assertEqual(engine.remaining_time(), 0.5)
+        self.assertFalse(engine.is_over())
+        engine.clock.advance(0.5)
+        self.assertTrue(engine.is_over())
+        engine.clock.advance(5)
+        self.assertEqual(engine.remaining_time(), 0)
+        # No scoring once time is up
+        self.assertEqual(engine.apply_move(0, 0, 0, 1), 0)
+        self.assertEqual(engine.grid.tolist(), [[4, 6]])
+
+    def test_reset_restarts_clock_and_score(self):
+        engine = self.make_engine([[4, 6]], time_limit=10)
+        engine.apply_move(0, 0, 0, 1)
+        engine.clock.advance(20)
+        engine.reset()
+        self.assertEqual((engine.score, engine.moves), (0, 0))
+        self.assertEqual(engine.remaining_time(), 10)
+        self.assertTrue(((engine.grid >= 1) & (engine.grid <= 9)).all())
+
+
+class PuzzleGameTests(unittest.TestCase):
+
+    def test_keeps_the_state_of_a_given_engine(self):
+        engine = PuzzleEngine(1, 2, seed=0)
+        engine.grid = np.array([[4, 6]])
+        engine.score, engine.moves = 7, 3
+        engine.clock.advance(5)
+
+        game = PuzzleGame(engine)
+        self.assertIs(game.engine, engine)
+        self.assertEqual(game.grid.tolist(), [[4, 6]])
+        self.assertEqual((game.score, game.grid_version), (7, 3))
+        self.assertEqual(engine.elapsed_time(), 5)
+
+    def make_game(self):
+        engine = PuzzleEngine(2, 4, seed=0)
+        engine.grid = np.array([[1, 9, 2, 8],
+                                [3, 7, 5, 5]])
+        game = PuzzleGame(engine)
+        game.draw_frame(120)
+        return game
+
+    def cells(self, game, rects):
+        """The cells drawn, given the rects a frame returned."""
+        cells = {game.cell_rect(row, col).topleft: (row, col) for row in range(game.ROWS) for col in range(game.COLS)}
+        return {cells[rect.topleft] for rect in rects if rect.topleft in cells}
+
+    def test_first_frame_and_layout_draw_everything(self):
+        game = self.make_game()
+        game.layout()
+        dirty_rects = game.draw_frame(120)
+        self.assertEqual(len(dirty_rects), 2 * 4 + 1)
+        self.assertEqual(len(self.cells(game, dirty_rects)), 2 * 4)
+
+    def test_unchanged_frame_draws_nothing(self):
+        game = self.make_game()
+        self.assertEqual(game.draw_frame(120), [])
+        # A new time redraws the status strip only
+        self.assertEqual(game.draw_frame(119), [pygame.Rect(0, game.HEIGHT - 40, game.WIDTH, 40)])
+
+    def test_clear_draws_the_cleared_cells(self):
+        game = self.make_game()
+        game.engine.apply_move(1, 2, 1, 3)
+        dirty_rects = game.draw_frame(120)
+        self.assertEqual(dirty_rects[:-1], [game.cell_rect(1, 2), game.cell_rect(1, 3)])
+        # The score changed too
+        self.assertEqual(dirty_rects[-1], pygame.Rect(0, game.HEIGHT - 40, game.WIDTH, 40))
+
+    def test_selection_draws_the_cells_whose_selection_changed(self):
+        game = self.make_game()
+        game.selected_cells = [(0, 0), (0, 1)]
+        self.assertEqual(self.cells(game, game.draw_frame(120)), {(0, 0), (0, 1)})
+        game.selected_cells = [(0, 1), (1, 1)]
+        self.assertEqual(self.cells(game, game.draw_frame(120)), {(0, 0), (1, 1)})
+
+        # Cleared cells are never highlighted
+        game.selected_cells = []
+        game.engine.apply_move(1, 2, 1, 3)
+        game.draw_frame(120)
+        game.selected_cells = [(1, 2), (1, 3)]
+        self.assertEqual(game.draw_frame(120), [])
+
+
+class EventChannelTests(unittest.TestCase):
+
+    def test_put_times_out_when_full(self):
+        channel = EventChannel(maxsize=2)
+        channel.put(1)
+        channel.put(2)
+        start_time = time.perf_counter()
+        with self.assertRaises(queue.Full):
+            channel.put(3, timeout=0.05)
+        self.assertGreaterEqual(time.perf_counter() - start_time, 0.05)
+        self.assertEqual(channel.drain(), [1, 2])
+
+    def test_drain_returns_each_item_once_in_order(self):
+        channel = EventChannel(maxsize=64)
+        num_writers, items_per_writer = 4, 500
+
+        def write(writer):
+            for i in range(items_per_writer):
+                channel.put(MoveCommand(writer, i, 0, 0), timeout=5)
+
+        writers = [threading.Thread(target=write, args=(writer,)) for writer in range(num_writers)]
+        for thread in writers:
+            thread.start()
+        received = []
+        while any(thread.is_alive() for thread in writers) or len(channel):
+            received.extend(channel.drain())
+            time.sleep(0.001)
+        for thread in writers:
+            thread.join()
+        received.extend(channel.drain())
+
+        self.assertEqual(len(received), num_writers * items_per_writer)
+        for writer in range(num_writers):
+            self.assertEqual([command.c1 for command in received if command.r1 == writer],
+                             list(range(items_per_writer)))
+
+    def test_drain_wakes_blocked_writers(self):
+        channel = EventChannel(maxsize=1)
+        channel.put("first")
+        done = threading.Event()
+
+        def write():
+            channel.put("second", timeout=5)
+            done.set()
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        self.assertFalse(done.wait(0.05))
+        self.assertEqual(channel.drain(), ["first"])
+        self.assertTrue(done.wait(5))
+        thread.join()
+        self.assertEqual(channel.drain(), ["second"])
+
+
+def brute_force_rectangles(grid, target=10):
+    rows, cols = grid.shape
+    return [(r1, c1, r2, c2)
+            for r1 in range(rows) for c1 in range(cols)
+            for r2 in range(r1, rows) for c2 in range(c1, cols)
+            if grid[r1:r2 + 1, c1:c2 + 1].sum() == target]
+
+
+class RectangleFinderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_find_all_matches_brute_force(self):
+        for rows, cols in [(1, 1), (3, 4), (5, 7), (10, 17)]:
+            finder = RectangleFinder(rows, cols)
+            for _ in range(5):
+                # Zeros as left by earlier clears
+                grid = self.rng.integers(1, 10, size=(rows, cols)) * (self.rng.random((rows, cols)) < 0.7)
+                expected = brute_force_rectangles(grid)
+                self.assertEqual(sorted(finder.find_all(grid)), sorted(expected))
+                self.assertEqual(finder.find_first(grid), min(expected) if expected else None)
+
+    def test_batched_sums_match_single_grids(self):
+        finder = RectangleFinder(4, 5)
+        grids = self.rng.integers(0, 10, size=(3, 4, 5))
+        sums = finder.rectangle_sums(grids)
+        for grid, grid_sums in zip(grids, sums):
+            np.testing.assert_array_equal(grid_sums, finder.rectangle_sums(grid))
+        np.testing.assert_array_equal(finder.rectangle_counts(grids[0]), finder.rectangle_sums(grids[0] != 0))
+
+    def test_clear_zeroes_each_rectangle_in_its_own_copy(self):
+        finder = RectangleFinder(3, 4)
+        grid = self.rng.integers(1, 10, size=(3, 4))
+        rectangles = [(0, 0, 0, 0), (1, 1, 2, 3), (0, 0, 2, 3)]
+        cleared = finder.clear(grid, rectangles)
+        self.assertEqual(cleared.shape, (3, 3, 4))
+        for (r1, c1, r2, c2), child in zip(rectangles, cleared):
+            expected = grid.copy()
+            expected[r1:r2 + 1, c1:c2 + 1] = 0
+            np.testing.assert_array_equal(child, expected)
+        self.assertTrue((grid != 0).all())
+
+
+class PlannerTests(unittest.TestCase):
+
+    def replay(self, grid, plan):
+        """Score of plan played through the engine, failing on any move the rules reject."""
+        engine = PuzzleEngine(*grid.shape, time_limit=float("inf"))
+        engine.grid = np.array(grid)
+        for rectangle in plan:
+            self.assertGreater(engine.apply_move(*rectangle), 0, rectangle)
+        return engine.score
+
+    def test_plan_replays_with_reported_score(self):
+        for seed in range(3):
+            grid = np.random.default_rng(seed).integers(1, 10, size=(6, 8))
+            planner = Planner(*grid.shape, beam_width=3, time_budget=0.2)
+            score, plan = planner.plan(grid)
+            self.assertEqual(self.replay(grid, plan), score)
+            # Nothing is left to clear at the end of a plan
+            engine_grid = grid.copy()
+            for r1, c1, r2, c2 in plan:
+                engine_grid[r1:r2 + 1, c1:c2 + 1] = 0
+            self.assertIsNone(planner.finder.find_first(engine_grid))
+
+    def test_plan_is_never_worse_than_greedy(self):
+        for seed in range(5):
+            grid = np.random.default_rng(seed).integers(1, 10, size=(10, 17))
+            planner = Planner(*grid.shape)
+            greedy_score, greedy_plan = planner.finish_greedily(grid, 0, [])
+            self.assertEqual(self.replay(grid, greedy_plan), greedy_score)
+            for time_budget in [0, 0.05]:
+                score, _ = planner.plan(grid, time_budget)
+                self.assertGreaterEqual(score, greedy_score)
+
+    def test_plan_without_moves(self):
+        planner = Planner(2, 2)
+        self.assertEqual(planner.plan(np.ones((2, 2), dtype=int)), (0, []))
+
+
+class HelperTests(unittest.TestCase):
+
+    def play(self, game, helper, timeout=10):
+        """
+        Run the game and the helper on their own threads until the board is cleared or timeout
+        seconds pass, then stop the game. Returns whether the helper thread exited.
+        """
+        game_thread = threading.Thread(target=game.run, daemon=True)
+        game_thread.start()
+        deadline = time.monotonic() + timeout
+        while not getattr(game, "running", False) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        helper_thread = threading.Thread(target=helper.run, daemon=True)
+        helper_thread.start()
+
+        version = game.grid_version
+        while game.grid.any() and time.monotonic() < deadline:
+            version = game.wait_for_grid_change(version, timeout=0.1)
+        game.stop()
+        helper_thread.join(timeout=5)
+
+        # Get the game loop past its game over screen
+        pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONUP, {"pos": (0, 0), "button": 1}))
+        game_thread.join(timeout=5)
+        return not helper_thread.is_alive()
+
+    def make_game(self):
+        engine = PuzzleEngine(2, 4, time_limit=60)
+        engine.grid = np.array([[1, 9, 2, 8],
+                                [3, 7, 5, 5]])
+        return PuzzleGame(engine)
+
+    def test_clears_board_and_exits_when_game_stops(self):
+        game = self.make_game()
+        helper = Helper(game)
+        searches = []
+        check_valid_rectangle = helper.check_valid_rectangle
+        helper.check_valid_rectangle = lambda grid=None: searches.append(grid) or check_valid_rectangle(grid)
+
+        self.assertTrue(self.play(game, helper))
+        self.assertFalse(game.grid.any())
+        self.assertEqual((game.score, game.grid_version), (8, 4))
+        # At most one search per grid version: the start and three boards between the clears,
+        # plus the cleared board unless the game stopped first. Never the same board twice
+        self.assertIn(len(searches), (4, 5))
+        self.assertEqual(len({grid.tobytes() for grid in searches}), len(searches))
+
+    def test_resends_a_lost_move(self):
+        game = self.make_game()
+        helper = Helper(game)
+        apply_move = game.apply_move
+        sent = []
+
+        def drop_first_move(*rectangle):
+            sent.append(rectangle)
+            if len(sent) > 1:
+                apply_move(*rectangle)
+
+        game.apply_move = drop_first_move
+        start_time = time.monotonic()
+        self.assertTrue(self.play(game, helper))
+
+        self.assertFalse(game.grid.any())
+        self.assertEqual(sent[0], sent[1])
+        # The helper waited out its one second timeout before resending
+        self.assertGreaterEqual(time.monotonic() - start_time, 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()